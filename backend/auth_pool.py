@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from passlib.context import CryptContext
+
+from search_cache import TTLCache
+
+# === Password Hashing Pool Settings ===
+# bcrypt releases the GIL, so threads are enough; "process" isolates the CPU burn completely
+AUTH_POOL_KIND = os.getenv("AUTH_POOL_KIND", "thread")
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+# Hash jobs running or waiting before new ones are rejected with 429
+AUTH_MAX_PENDING = int(os.getenv("AUTH_MAX_PENDING", "32"))
+AUTH_RETRY_AFTER_SECONDS = int(os.getenv("AUTH_RETRY_AFTER_SECONDS", "1"))
+# Session tokens issued at login, and repeat logins with an already verified password
+SESSION_TOKEN_TTL = int(os.getenv("SESSION_TOKEN_TTL", "3600"))
+VERIFIED_LOGIN_TTL = int(os.getenv("VERIFIED_LOGIN_TTL", "300"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def hash_password(password):
+    return pwd_context.hash(password)
+
+
+class PoolSaturated(Exception):
+    """Raised when the hashing pool already has AUTH_MAX_PENDING jobs outstanding"""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated pool with a bound on outstanding jobs"""
+
+    def __init__(self, kind: str = AUTH_POOL_KIND, workers: int = AUTH_HASH_WORKERS, max_pending: int = AUTH_MAX_PENDING):
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = 0
+        self.rejected = 0
+
+    @property
+    def executor(self):
+        # Created on first use so a process pool is never inherited across a worker fork
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolSaturated()
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(verify_password, password, hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        return {"kind": self.kind, "workers": self.workers, "pending": self._pending, "rejected": self.rejected}
+
+
+class SessionTokens:
+    """Login session tokens and recently verified credentials.
+
+    Tokens live in a local TTL cache in front of an optional TTL-indexed
+    collection shared by all workers. Verified credentials are remembered
+    as an HMAC of (username, password, stored hash) under a per-process key,
+    so a repeated login with the same password skips bcrypt and a password
+    change invalidates the entry.
+    """
+
+    def __init__(self, collection=None, token_ttl: int = SESSION_TOKEN_TTL, verified_ttl: int = VERIFIED_LOGIN_TTL):
+        self.collection = collection
+        self.token_ttl = token_ttl
+        self.tokens = TTLCache(AUTH_CACHE_MAX_ENTRIES, token_ttl)
+        self.verified = TTLCache(AUTH_CACHE_MAX_ENTRIES, verified_ttl)
+        self._key = secrets.token_bytes(32)
+        self.token_hits = 0
+        self.verified_hits = 0
+
+    def _credential_digest(self, username: str, password: str, hashed: str) -> str:
+        message = "\x1f".join((username, password, hashed)).encode()
+        return hmac.new(self._key, message, hashlib.sha256).hexdigest()
+
+    def was_verified(self, username: str, password: str, hashed: str) -> bool:
+        if self.verified.get(self._credential_digest(username, password, hashed)):
+            self.verified_hits += 1
+            return True
+        return False
+
+    def remember_verified(self, username: str, password: str, hashed: str):
+        self.verified.set(self._credential_digest(username, password, hashed), True)
+
+    async def issue(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        self.tokens.set(token, username)
+        if self.collection is not None:
+            await self.collection.insert_one({
+                "_id": hashlib.sha256(token.encode()).hexdigest(),
+                "username": username,
+                "expires_at": datetime.utcnow() + timedelta(seconds=self.token_ttl)
+            })
+        return token
+
+    async def username_for(self, token: str) -> Optional[str]:
+        username = self.tokens.get(token)
+        if username is None and self.collection is not None:
+            doc = await self.collection.find_one({
+                "_id": hashlib.sha256(token.encode()).hexdigest(),
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+            if doc is not None:
+                username = doc["username"]
+                self.tokens.set(token, username, ttl=(doc["expires_at"] - datetime.utcnow()).total_seconds())
+        if username is not None:
+            self.token_hits += 1
+        return username
+
+    def stats(self) -> Dict:
+        return {"token_hits": self.token_hits, "verified_login_hits": self.verified_hits, "tokens_cached": len(self.tokens)}
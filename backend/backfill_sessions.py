@@ -0,0 +1,65 @@
+"""One-shot backfill of the `sessions` summary collection from `chat_history`.
+
+Usage:
+    python backfill_sessions.py [--keep-existing]
+
+Uses MONGO_URI / MONGO_DB like the API server.
+"""
+import argparse
+import time
+
+from pymongo import MongoClient
+
+from storage import INDEXES, MONGO_DB, MONGO_URI, SUPERSEDED_INDEXES
+
+
+def backfill(database, keep_existing: bool = False) -> int:
+    for name, specs in INDEXES.items():
+        for keys, options in specs:
+            database[name].create_index(keys, **options)
+    for name, indexes in SUPERSEDED_INDEXES.items():
+        existing = database[name].index_information()
+        for index in indexes:
+            if index in existing:
+                database[name].drop_index(index)
+
+    pipeline = [
+        {"$sort": {"username": 1, "session_id": 1, "created_at": 1}},
+        {"$group": {
+            "_id": {"username": "$username", "session_id": "$session_id"},
+            "preview": {"$first": "$message"},
+            "created_at": {"$first": "$created_at"},
+            "updated_at": {"$last": "$created_at"},
+            "message_count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "username": "$_id.username",
+            "session_id": "$_id.session_id",
+            "preview": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            "message_count": 1
+        }},
+        {"$merge": {
+            "into": "sessions",
+            "on": ["username", "session_id"],
+            "whenMatched": "keepExisting" if keep_existing else "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    database["chat_history"].aggregate(pipeline, allowDiskUse=True)
+    return database["sessions"].estimated_document_count()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the sessions collection from chat_history")
+    parser.add_argument("--keep-existing", action="store_true",
+                        help="Do not overwrite sessions that already have a summary (e.g. renamed ones)")
+    args = parser.parse_args()
+
+    client = MongoClient(MONGO_URI)
+    started = time.perf_counter()
+    total = backfill(client[MONGO_DB], keep_existing=args.keep_existing)
+    print(f"Backfilled sessions collection: {total} sessions in {time.perf_counter() - started:.1f}s")
+    client.close()
@@ -0,0 +1,292 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from telemetry import BATCH_ITEMS
+
+# === Batch Settings ===
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+# Items of one job in flight at once
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "32"))
+# Upstream calls of all batch jobs together, per provider; interactive /chat traffic is not counted
+BATCH_COHERE_CONCURRENCY = int(os.getenv("BATCH_COHERE_CONCURRENCY", "8"))
+BATCH_SERPAPI_CONCURRENCY = int(os.getenv("BATCH_SERPAPI_CONCURRENCY", "4"))
+BATCH_MAX_ACTIVE_JOBS = int(os.getenv("BATCH_MAX_ACTIVE_JOBS", "4"))
+# How long a finished job stays pollable
+BATCH_JOB_TTL_SECONDS = float(os.getenv("BATCH_JOB_TTL_SECONDS", "3600"))
+# Bounds the stored state of a job that never finishes (its worker died)
+BATCH_MAX_LIFETIME_SECONDS = float(os.getenv("BATCH_MAX_LIFETIME_SECONDS", str(6 * 3600)))
+# How often streams of a job, and the worker running it (for cancellations), look at the stored state
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_MS", "250")) / 1000
+
+QUEUED, RUNNING, DONE, CANCELLED = "queued", "running", "done", "cancelled"
+
+
+class BatchFull(Exception):
+    """BATCH_MAX_ACTIVE_JOBS jobs are already running in this worker"""
+
+
+class ProviderLimits:
+    """One semaphore per upstream provider, shared by every batch job of this worker"""
+
+    def __init__(self, caps: Dict[str, int]):
+        self.caps = dict(caps)
+        self._semaphores = {provider: asyncio.Semaphore(cap) for provider, cap in caps.items()}
+        self.in_flight = {provider: 0 for provider in caps}
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        async with self._semaphores[provider]:
+            self.in_flight[provider] += 1
+            try:
+                yield
+            finally:
+                self.in_flight[provider] -= 1
+
+    def stats(self) -> Dict:
+        return {provider: {"cap": cap, "in_flight": self.in_flight[provider]} for provider, cap in self.caps.items()}
+
+
+# Answers one message; raising marks the item as failed
+ItemHandler = Callable[[str, ProviderLimits], Awaitable[dict]]
+
+
+def summary_of(job: dict) -> Dict:
+    elapsed = None
+    if job.get("started_at") is not None:
+        elapsed = round(((job.get("finished_at") or datetime.utcnow()) - job["started_at"]).total_seconds(), 3)
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "items": job["items"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "elapsed_seconds": elapsed,
+    }
+
+
+class BatchStore:
+    """Job state in `batch_jobs` and one `batch_results` document per answered item.
+
+    Any worker can serve the status, the stream or the cancellation of a
+    job; only the worker that accepted it runs its items. Results carry
+    `seq`, their completion order, so streams can resume from a position.
+    """
+
+    def __init__(self, jobs, results):
+        self.jobs = jobs
+        self.results = results
+
+    async def create(self, messages: List[str]) -> dict:
+        now = datetime.utcnow()
+        job = {
+            "_id": uuid.uuid4().hex[:16],
+            "status": QUEUED,
+            "items": len(messages),
+            "messages": messages,
+            "completed": 0,
+            "failed": 0,
+            "cancel_requested": False,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": now + timedelta(seconds=BATCH_MAX_LIFETIME_SECONDS),
+        }
+        await self.jobs.insert_one(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.jobs.find_one({"_id": job_id}, {"messages": 0})
+
+    async def start(self, job_id: str):
+        await self.jobs.update_one({"_id": job_id}, {"$set": {"status": RUNNING, "started_at": datetime.utcnow()}})
+
+    async def complete(self, job_id: str, seq: int, result: dict):
+        await self.results.insert_one({
+            "_id": f"{job_id}:{result['index']}",
+            "job_id": job_id,
+            "seq": seq,
+            "result": result,
+            "expires_at": datetime.utcnow() + timedelta(seconds=BATCH_MAX_LIFETIME_SECONDS),
+        })
+        await self.jobs.update_one({"_id": job_id}, {"$inc": {"completed": 1, "failed": int(result["status"] != "ok")}})
+
+    async def finish(self, job_id: str, status: str, ttl: float):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl)
+        await self.jobs.update_one({"_id": job_id}, {"$set": {"status": status, "finished_at": now, "expires_at": expires_at}})
+        await self.results.update_many({"job_id": job_id}, {"$set": {"expires_at": expires_at}})
+
+    async def request_cancel(self, job_id: str):
+        await self.jobs.update_one({"_id": job_id, "status": {"$in": [QUEUED, RUNNING]}},
+                                   {"$set": {"cancel_requested": True}})
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        job = await self.jobs.find_one({"_id": job_id}, {"cancel_requested": 1})
+        return job is None or job["cancel_requested"]
+
+    async def results_from(self, job_id: str, seq: int = 0) -> List[dict]:
+        return await self.results.find({"job_id": job_id, "seq": {"$gte": seq}}).sort("seq", 1).to_list(None)
+
+
+class BatchJob:
+    """The part of a job only its running worker needs"""
+
+    def __init__(self, job_id: str, messages: List[str]):
+        self.id = job_id
+        self.messages = messages
+        self.completed = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class BatchRunner:
+    """Runs batch jobs through a bounded pool of workers per job and per-provider caps across jobs.
+
+    Wall time of a job is roughly items / effective concurrency x item
+    latency, where the effective concurrency is the smallest of the job's
+    workers and the provider caps its items go through.
+    """
+
+    def __init__(self, handler: ItemHandler, store: BatchStore, limits: Optional[ProviderLimits] = None,
+                 workers: int = BATCH_WORKERS, max_active: int = BATCH_MAX_ACTIVE_JOBS, ttl: float = BATCH_JOB_TTL_SECONDS):
+        self.handler = handler
+        self.store = store
+        self.limits = limits or ProviderLimits({
+            "cohere": BATCH_COHERE_CONCURRENCY,
+            "serpapi": BATCH_SERPAPI_CONCURRENCY,
+        })
+        self.workers = workers
+        self.max_active = max_active
+        self.ttl = ttl
+        self._running: Dict[str, BatchJob] = {}
+        self.submitted = 0
+        self.items_done = 0
+        self.items_failed = 0
+
+    async def submit(self, messages: List[str]) -> dict:
+        if len(self._running) >= self.max_active:
+            raise BatchFull(f"{len(self._running)} batch jobs are already running")
+        stored = await self.store.create(messages)
+        job = BatchJob(stored["_id"], messages)
+        self._running[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        job.task.add_done_callback(lambda _: self._running.pop(job.id, None))
+        self.submitted += 1
+        return stored
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.store.get(job_id)
+
+    async def snapshot(self, job_id: str, include_results: bool = True) -> Optional[Dict]:
+        job = await self.store.get(job_id)
+        if job is None:
+            return None
+        body = summary_of(job)
+        if include_results:
+            # Input order; null for items that are still pending
+            results: List[Optional[dict]] = [None] * job["items"]
+            for doc in await self.store.results_from(job_id):
+                results[doc["result"]["index"]] = doc["result"]
+            body["results"] = results
+        return body
+
+    async def follow(self, job_id: str) -> AsyncIterator[dict]:
+        """Results as they complete (those already done first), then the final summary"""
+        position = 0
+        while True:
+            job = await self.store.get(job_id)
+            if job is None:
+                return
+            done = job["status"] in (DONE, CANCELLED)
+            for doc in await self.store.results_from(job_id, position):
+                # Items finish out of order; wait for a gap to fill unless the job is over
+                if doc["seq"] != position and not done:
+                    break
+                yield dict(doc["result"], type="result")
+                position = doc["seq"] + 1
+            if done:
+                yield dict(summary_of(job), type="summary")
+                return
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        """Stop a job, whichever worker runs it; results completed so far stay pollable"""
+        job = self._running.get(job_id)
+        if job is not None:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        else:
+            await self.store.request_cancel(job_id)
+            # The worker running it notices within a poll interval
+            for _ in range(8):
+                stored = await self.store.get(job_id)
+                if stored is None or stored["status"] in (DONE, CANCELLED):
+                    break
+                await asyncio.sleep(BATCH_POLL_SECONDS)
+        return await self.store.get(job_id)
+
+    async def _watch_cancel(self, job: BatchJob):
+        while not await self.store.cancel_requested(job.id):
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+        job.task.cancel()
+
+    async def _run(self, job: BatchJob):
+        queue = asyncio.Queue()
+        for index in range(len(job.messages)):
+            queue.put_nowait(index)
+        await self.store.start(job.id)
+        workers = [asyncio.create_task(self._worker(job, queue)) for _ in range(min(self.workers, len(job.messages)))]
+        watcher = asyncio.create_task(self._watch_cancel(job))
+        status = DONE
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            status = CANCELLED
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            watcher.cancel()
+            # Recorded even if the cancellation arrives while we get here
+            await asyncio.shield(self.store.finish(job.id, status, self.ttl))
+
+    async def _worker(self, job: BatchJob, queue: asyncio.Queue):
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            message = job.messages[index]
+            started = time.perf_counter()
+            try:
+                result = dict(await self.handler(message, self.limits), status="ok")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = {"status": "error", "error": str(e) or type(e).__name__}
+                self.items_failed += 1
+            self.items_done += 1
+            BATCH_ITEMS.inc(result=result["status"])
+            result.update(index=index, message=message, seconds=round(time.perf_counter() - started, 3))
+            seq = job.completed
+            job.completed += 1
+            await self.store.complete(job.id, seq, result)
+
+    async def stop(self):
+        tasks = [job.task for job in self._running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "active_jobs": len(self._running),
+            "submitted": self.submitted,
+            "items_done": self.items_done,
+            "items_failed": self.items_failed,
+            "providers": self.limits.stats(),
+        }
@@ -0,0 +1,71 @@
+"""Show how POST /batch wall time follows the concurrency cap, not the item count.
+
+Starts bench.fakes and the API server (in-memory MongoDB) once per Cohere
+cap, submits the same batch of distinct LLM-flow questions, follows the
+NDJSON stream to the summary line and compares the wall time with the
+ideal items / cap x FAKE_COMPLETION_MS.
+
+Usage (from the backend directory):
+    python -m bench.batch_check --items 200 --caps 4,16,64
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+from bench.run_bench import app_environment, free_port, start_server, wait_ready
+
+
+async def run_once(items: int, cap: int) -> dict:
+    fake_port, app_port = free_port(), free_port()
+    app_env = app_environment(fake_port,
+                              BATCH_COHERE_CONCURRENCY=str(cap),
+                              BATCH_WORKERS=str(max(cap, 1)),
+                              UPSTREAM_INITIAL_LIMIT=str(max(cap, 16)))
+    fake = start_server("bench.fakes:app", fake_port, dict(os.environ))
+    server = start_server("mongo_apis1:app", app_port, app_env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{fake_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{app_port}/metrics")
+        base_url = f"http://127.0.0.1:{app_port}"
+        # Distinct questions, so request coalescing does not merge them
+        messages = [f"explain how photosynthesis works, part {i}" for i in range(items)]
+        async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+            started = time.perf_counter()
+            job = (await client.post("/batch", json={"messages": messages})).json()
+            summary = None
+            async with client.stream("GET", job["stream_url"]) as response:
+                async for line in response.aiter_lines():
+                    if line:
+                        summary = json.loads(line)
+            elapsed = time.perf_counter() - started
+    finally:
+        for proc in (server, fake):
+            proc.terminate()
+            proc.wait(timeout=10)
+    return {"cap": cap, "elapsed": elapsed, "summary": summary}
+
+
+async def run(items: int, caps):
+    completion_ms = float(os.getenv("FAKE_COMPLETION_MS", "400"))
+    for cap in caps:
+        result = await run_once(items, cap)
+        ideal = -(-items // cap) * completion_ms / 1000
+        summary = result["summary"] or {}
+        print(f"cap {cap:>4}: {items} items in {result['elapsed']:.2f}s "
+              f"(ideal {ideal:.2f}s, {summary.get('failed', '?')} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch wall time against local fakes, per concurrency cap")
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--caps", default="4,16,64", help="comma separated BATCH_COHERE_CONCURRENCY values")
+    args = parser.parse_args()
+    asyncio.run(run(args.items, [int(cap) for cap in args.caps.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Count rolling-summary compactions over a long session.
+
+Plays a session turn by turn against in-memory collections: each turn
+loads the history window, schedules compaction as /chat does, then stores
+the user message and the reply. The summarizer is a stub that counts its
+calls, so the output shows how often a session past the window is
+summarized and how many turns each call folds in.
+
+Usage (from the backend directory):
+    python -m bench.compaction_check --turns 60 --words 60
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+
+from history_window import HISTORY_COMPACT_MIN_TOKENS, HISTORY_COMPACT_MIN_TURNS, HistoryWindow
+from storage import close_database, connect_database
+
+USERNAME = "compaction"
+SESSION_ID = "s0"
+
+
+async def run(turns: int, words: int):
+    database = connect_database("memory", name="bench")
+    messages = database["chat_history"]
+    sessions = database["sessions"]
+    await sessions.insert_one({"username": USERNAME, "session_id": SESSION_ID})
+    folded = []
+
+    async def summarize(prompt: str) -> str:
+        folded.append(prompt.count("\nUser: ") + prompt.count("\nChatbot: "))
+        return f"summary #{len(folded)}"
+
+    window = HistoryWindow(messages, sessions, summarize)
+    started = datetime.utcnow() - timedelta(days=1)
+    text = " ".join(["word"] * words)
+    for turn in range(turns):
+        _, boundary = await window.load(SESSION_ID, USERNAME)
+        window.schedule_compaction(SESSION_ID, USERNAME, boundary)
+        await asyncio.gather(*window._tasks)
+        for offset, role in enumerate(("user", "assistant")):
+            await messages.insert_one({
+                "session_id": SESSION_ID, "username": USERNAME, "role": role, "message": text,
+                "created_at": started + timedelta(seconds=2 * turn + offset),
+            })
+
+    close_database(database)
+    print(f"{turns} turns of {words} words each: {len(folded)} summarize calls, "
+          f"messages folded per call {folded} "
+          f"(HISTORY_COMPACT_MIN_TURNS={HISTORY_COMPACT_MIN_TURNS}, HISTORY_COMPACT_MIN_TOKENS={HISTORY_COMPACT_MIN_TOKENS})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count history compactions over a long session")
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--words", type=int, default=60)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.words))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Local stand-ins for the Cohere chat API and SerpAPI used by the benchmark harness.
+
+Run with `uvicorn bench.fakes:app --port 9100` from the backend directory and point
+the API server at it with COHERE_API_URL=http://127.0.0.1:9100/v1/chat and
+SERP_API_URL=http://127.0.0.1:9100/search. Search results link to HTML pages served
+by the same app (/page/{n}), so result-page retrieval never leaves the machine.
+"""
+import asyncio
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# === Simulation Settings ===
+FAKE_FIRST_TOKEN_MS = float(os.getenv("FAKE_FIRST_TOKEN_MS", "300"))
+FAKE_TOKENS_PER_SECOND = float(os.getenv("FAKE_TOKENS_PER_SECOND", "50"))
+FAKE_TOKENS = int(os.getenv("FAKE_TOKENS", "200"))
+FAKE_COMPLETION_MS = float(os.getenv("FAKE_COMPLETION_MS", "400"))
+FAKE_SEARCH_MS = float(os.getenv("FAKE_SEARCH_MS", "800"))
+FAKE_PAGE_MS = float(os.getenv("FAKE_PAGE_MS", "150"))
+FAKE_PAGE_PARAGRAPHS = int(os.getenv("FAKE_PAGE_PARAGRAPHS", "40"))
+
+WORDS = ("the quick brown fox jumps over the lazy dog while markets rally and "
+         "scientists announce new results about climate energy and space ").split()
+
+app = FastAPI()
+
+
+def fake_token(i: int) -> str:
+    return WORDS[i % len(WORDS)] + " "
+
+
+@app.post("/v1/chat")
+async def cohere_chat(request: Request):
+    payload = await request.json()
+    if not payload.get("stream"):
+        await asyncio.sleep(FAKE_COMPLETION_MS / 1000)
+        return {"text": "fake rewritten search query about " + payload.get("message", "")[:40]}
+
+    async def events():
+        yield json.dumps({"is_finished": False, "event_type": "stream-start", "generation_id": "fake"}) + "\n"
+        await asyncio.sleep(FAKE_FIRST_TOKEN_MS / 1000)
+        interval = 1 / FAKE_TOKENS_PER_SECOND if FAKE_TOKENS_PER_SECOND > 0 else 0
+        for i in range(FAKE_TOKENS):
+            yield json.dumps({"is_finished": False, "event_type": "text-generation", "text": fake_token(i)}) + "\n"
+            if interval:
+                await asyncio.sleep(interval)
+        yield json.dumps({"is_finished": True, "event_type": "stream-end", "finish_reason": "COMPLETE"}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.get("/search")
+async def serp_search(request: Request, q: str = "", num: int = 3):
+    await asyncio.sleep(FAKE_SEARCH_MS / 1000)
+    return {
+        "organic_results": [
+            {
+                "title": f"Result {i + 1} for {q}",
+                "snippet": f"Snippet {i + 1}: " + " ".join(WORDS[:20]),
+                "link": f"{request.base_url}page/{i + 1}?q={q.replace(' ', '+')}"
+            }
+            for i in range(num)
+        ]
+    }
+
+
+@app.get("/page/{number}")
+async def result_page(number: int, q: str = "", delay_ms: float = FAKE_PAGE_MS):
+    """A result page streamed in pieces: boilerplate, filler prose, and one paragraph about the query"""
+    async def body():
+        await asyncio.sleep(delay_ms / 1000)
+        yield (f"<html><head><title>Result {number}</title><script>var tracking = true;</script></head><body>"
+               "<nav><a href='/'>Home</a> <a href='/news'>News</a></nav><main>")
+        for i in range(FAKE_PAGE_PARAGRAPHS):
+            if i == number * 3 % FAKE_PAGE_PARAGRAPHS:
+                yield f"<p>Page {number} reports on {q}: " + " ".join(WORDS) + f" {q}.</p>"
+            else:
+                yield "<p>" + " ".join(WORDS[(i + j) % len(WORDS)] for j in range(60)) + ".</p>"
+            await asyncio.sleep(0)
+        yield "</main><footer>Copyright</footer></body></html>"
+
+    return StreamingResponse(body(), media_type="text/html; charset=utf-8")
@@ -0,0 +1,90 @@
+"""Keyset paging of /sessions and /chat/{session_id} with unflushed write-behind rows.
+
+Stores some rows, leaves more in the write-behind queue (its flusher is
+never started), then walks every page with a small limit through the
+X-Before-Cursor headers. Every row must come back exactly once, in order,
+and no page may hold more than `limit` rows.
+
+Usage (from the backend directory):
+    python -m bench.paging_check --stored 4 --queued 2 --limit 2
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+os.environ.update(MONGO_BACKEND="memory", WRITE_BEHIND_ENABLED="1")
+os.environ.setdefault("COHERE_API_KEY", "bench")
+os.environ.setdefault("SERP_API_KEY", "bench")
+
+import httpx
+from bson import ObjectId
+
+import mongo_apis1 as api
+
+USERNAME = "paging"
+
+
+def message(session_id: str, text: str, created_at: datetime) -> dict:
+    return {"_id": ObjectId(), "session_id": session_id, "role": "user", "message": text, "username": USERNAME,
+            "source_type": None, "sources": [], "created_at": created_at}
+
+
+async def walk(client: httpx.AsyncClient, path: str, limit: int, key: str) -> list:
+    """Oldest-first keys of every page, following X-Before-Cursor from the newest page"""
+    pages = []
+    params = {"username": USERNAME, "limit": limit}
+    while True:
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+        page = [item[key] for item in response.json()]
+        assert len(page) <= limit, f"{path}: page of {len(page)} rows with limit {limit}"
+        pages.append(page)
+        before = response.headers.get("X-Before-Cursor")
+        if before is None:
+            break
+        params = {"username": USERNAME, "limit": limit, "before": before}
+    print(f"{path}: pages, newest first: {pages}")
+    rows = []
+    for page in reversed(pages):
+        rows += page if key == "message" else page[::-1]
+    return rows
+
+
+async def run(stored: int, queued: int, limit: int):
+    start = datetime.utcnow() - timedelta(hours=1)
+    messages = [message("s0", f"m{i}", start + timedelta(seconds=i)) for i in range(stored + queued)]
+    await api.persist_messages(messages[:stored])
+    for doc in messages[stored:]:
+        api.write_queue.submit(doc)
+
+    sessions = [message(f"s{i + 1}", f"first of s{i + 1}", start + timedelta(minutes=i + 1))
+                for i in range(stored + queued)]
+    await api.persist_messages(sessions[:stored])
+    for doc in sessions[stored:]:
+        api.write_queue.submit(doc)
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://paging.test") as client:
+        rows = await walk(client, "/chat/s0", limit, "message")
+        expected = [doc["message"] for doc in messages]
+        assert rows == expected, f"messages: got {rows}, expected {expected}"
+
+        rows = await walk(client, "/sessions", limit, "session_id")
+        # Oldest first: s0 (started before the others), then s1...
+        expected = ["s0"] + [doc["session_id"] for doc in sessions]
+        assert rows == expected, f"sessions: got {rows}, expected {expected}"
+    print(f"paging with {queued} queued rows: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check keyset paging while write-behind rows are queued")
+    parser.add_argument("--stored", type=int, default=4)
+    parser.add_argument("--queued", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.stored, args.queued, args.limit))
+
+
+if __name__ == "__main__":
+    main()
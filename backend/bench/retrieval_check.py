@@ -0,0 +1,67 @@
+"""Exercise result-page retrieval against the local fake server.
+
+Starts bench.fakes, searches it, and runs the Retriever over the results:
+pages are fetched concurrently under the deadline, their text is extracted
+while streaming, and the BM25-ranked passages are fitted to the token
+budget. One result is made slower than the deadline to show that it is cut
+off without holding up the others.
+
+Usage (from the backend directory):
+    python -m bench.retrieval_check --query "solar eclipse forecast"
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from bench.run_bench import free_port, start_server, wait_ready
+from history_window import estimate_tokens
+from http_client import AsyncHTTPClient
+from retrieval import RETRIEVAL_DEADLINE_SECONDS, Retriever
+
+
+async def run(query: str, results: int, slow_ms: float):
+    port = free_port()
+    fake = start_server("bench.fakes:app", port, dict(os.environ, FAKE_SEARCH_MS="0"))
+    base_url = f"http://127.0.0.1:{port}"
+    client = AsyncHTTPClient()
+    try:
+        await wait_ready(f"{base_url}/search")
+        async with httpx.AsyncClient() as http:
+            organic = (await http.get(f"{base_url}/search", params={"q": query, "num": results})).json()["organic_results"]
+        # The last result answers slower than the whole retrieval deadline
+        organic[-1]["link"] += f"&delay_ms={slow_ms}"
+
+        # The fake pages live on loopback
+        retriever = Retriever(client=client, allow_private=True)
+        started = time.perf_counter()
+        context = await retriever.build_context(query, organic)
+        elapsed = time.perf_counter() - started
+
+        snippets = "\n\n".join(f"{item['title']}: {item['snippet']}\n{item['link']}" for item in organic)
+        print(context)
+        print()
+        print(f"retrieval took {elapsed:.2f}s (deadline {RETRIEVAL_DEADLINE_SECONDS}s): {retriever.stats()}")
+        print(f"context ~{estimate_tokens(context)} tokens (budget {retriever.token_budget}), "
+              f"snippets alone ~{estimate_tokens(snippets)} tokens")
+        mentions = context.lower().count(query.lower())
+        print(f"passages naming the query: {mentions}")
+    finally:
+        await client.aclose()
+        fake.terminate()
+        fake.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check result-page retrieval against local fakes")
+    parser.add_argument("--query", default="solar eclipse forecast")
+    parser.add_argument("--results", type=int, default=5)
+    parser.add_argument("--slow-ms", type=float, default=RETRIEVAL_DEADLINE_SECONDS * 2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.query, args.results, args.slow_ms))
+
+
+if __name__ == "__main__":
+    main()
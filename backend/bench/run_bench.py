@@ -0,0 +1,227 @@
+"""Offline load test for the streaming /chat endpoint.
+
+Starts the fake Cohere/SerpAPI server and the API server (in-memory MongoDB) as
+subprocesses, drives N concurrent SSE clients and reports time to first token,
+tokens/sec, requests/sec and server memory. Results are written to
+bench/results/ so runs on different commits can be compared.
+
+Usage (from the backend directory):
+    python -m bench.run_bench --clients 100 --requests 5
+    python -m bench.run_bench --compare bench/results/<earlier>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+MESSAGES = {
+    "greeting": "hello there, how are you?",
+    "web": "what is the latest news about the stock market today",
+    "llm": "explain how photosynthesis works",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(target: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+
+
+def app_environment(fake_port: int, **overrides) -> dict:
+    """Environment for the API server: in-memory MongoDB, upstreams pointed at the fakes"""
+    return dict(os.environ,
+                MONGO_BACKEND="memory",
+                # The fakes ignore the keys, but an empty key makes an illegal Authorization header
+                COHERE_API_KEY=os.getenv("COHERE_API_KEY") or "bench",
+                SERP_API_KEY=os.getenv("SERP_API_KEY") or "bench",
+                COHERE_API_URL=f"http://127.0.0.1:{fake_port}/v1/chat",
+                SERP_API_URL=f"http://127.0.0.1:{fake_port}/search",
+                # The fake result pages are served from loopback too
+                RETRIEVAL_ALLOW_PRIVATE="1",
+                **overrides)
+
+
+async def wait_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up within {timeout}s")
+
+
+def rss_mb(pid: int):
+    """(current, peak) resident memory of a process in MB, Linux only"""
+    try:
+        fields = dict(
+            line.split(":", 1) for line in Path(f"/proc/{pid}/status").read_text().splitlines() if ":" in line
+        )
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        return None, None
+
+
+async def one_chat(client: httpx.AsyncClient, base_url: str, session_id: str, message: str) -> dict:
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    error = None
+    params = {"session_id": session_id, "message": message, "username": "bench"}
+    try:
+        async with client.stream("GET", f"{base_url}/chat", params=params) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = json.loads(line[6:])
+                if data.get("response"):
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    tokens += 1
+                if data.get("error"):
+                    error = data["error"]
+                if data.get("is_finished"):
+                    break
+    except httpx.HTTPError as e:
+        error = str(e)
+    finished = time.perf_counter()
+    return {
+        "ttft": first_token - started if first_token else None,
+        "tokens": tokens,
+        "stream_seconds": finished - first_token if first_token else None,
+        "total": finished - started,
+        "error": error,
+    }
+
+
+async def drive(base_url: str, clients: int, requests_per_client: int, flows) -> tuple:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120)) as client:
+        async def worker(n: int):
+            results = []
+            for i in range(requests_per_client):
+                flow = flows[(n + i) % len(flows)]
+                results.append(await one_chat(client, base_url, f"bench-{n}", MESSAGES[flow]))
+            return results
+
+        started = time.perf_counter()
+        per_worker = await asyncio.gather(*(worker(n) for n in range(clients)))
+        elapsed = time.perf_counter() - started
+    return [r for results in per_worker for r in results], elapsed
+
+
+def percentile(values, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(samples, elapsed: float) -> dict:
+    ok = [s for s in samples if not s["error"] and s["ttft"] is not None]
+    ttfts = [s["ttft"] for s in ok]
+    rates = [s["tokens"] / s["stream_seconds"] for s in ok if s["stream_seconds"]]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "requests_per_sec": round(len(samples) / elapsed, 2),
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 1) if ttfts else None,
+        "ttft_p99_ms": round(percentile(ttfts, 99) * 1000, 1) if ttfts else None,
+        "tokens_per_sec_per_stream": round(statistics.mean(rates), 1) if rates else None,
+        "tokens_per_sec_total": round(sum(s["tokens"] for s in ok) / elapsed, 1),
+        "elapsed_sec": round(elapsed, 2),
+        # Most frequent error texts, so a run that fails wholesale says why
+        "error_messages": dict(Counter(s["error"] or "no tokens" for s in samples if s["error"] or s["ttft"] is None).most_common(5)),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}):")
+    for key, value in current["summary"].items():
+        before = baseline.get("summary", {}).get(key)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            print(f"  {key:28} {before:>10} -> {value:>10} ({(value - before) / before * 100:+.1f}%)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test /chat against local fakes")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent SSE clients")
+    parser.add_argument("--requests", type=int, default=3, help="sequential requests per client")
+    parser.add_argument("--flows", default="greeting,web,llm", help="comma separated flows to cycle through")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    flows = [f for f in args.flows.split(",") if f in MESSAGES]
+
+    fake_port, app_port = free_port(), free_port()
+    fake_env = dict(os.environ)
+    app_env = app_environment(fake_port)
+    fake = start_server("bench.fakes:app", fake_port, fake_env)
+    server = start_server("mongo_apis1:app", app_port, app_env)
+    try:
+        await wait_ready(f"http://127.0.0.1:{fake_port}/docs")
+        await wait_ready(f"http://127.0.0.1:{app_port}/metrics")
+        base_url = f"http://127.0.0.1:{app_port}"
+        rss_before, _ = rss_mb(server.pid)
+        samples, elapsed = await drive(base_url, args.clients, args.requests, flows)
+        rss_after, rss_peak = rss_mb(server.pid)
+    finally:
+        for proc in (server, fake):
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "clients": args.clients,
+            "requests_per_client": args.requests,
+            "flows": flows,
+            "fake": {k: v for k, v in os.environ.items() if k.startswith("FAKE_")},
+        },
+        "summary": summarize(samples, elapsed),
+        "memory_mb": {"rss_before": rss_before, "rss_after": rss_after, "rss_peak": rss_peak},
+    }
+    print(json.dumps(result, indent=2))
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{result['commit']}.json"
+        path.write_text(json.dumps(result, indent=2))
+        print(f"Saved {path}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""Per-token CPU cost of the SSE relay path.
+
+Feeds synthetic Cohere stream lines through the former string pipeline
+(decode, re-encode, decode again, f-string frame, `+=` accumulation) and
+through the current one (sse.parse_cohere_line, pre-encoded byte frames,
+list accumulation), and reports CPU nanoseconds per token.
+
+Usage (from the backend directory):
+    python -m bench.stream_micro --tokens 2000 --repeat 20
+"""
+import argparse
+import json
+import time
+
+from sse import END, TEXT, frame, orjson, parse_cohere_line, text_frame
+
+
+def cohere_lines(tokens: int):
+    lines = [json.dumps({"is_finished": False, "event_type": "stream-start", "generation_id": "bench"})]
+    lines += [
+        json.dumps({"is_finished": False, "event_type": "text-generation", "text": f" token{i} ✨"})
+        for i in range(tokens)
+    ]
+    lines.append(json.dumps({"is_finished": True, "event_type": "stream-end", "finish_reason": "COMPLETE"}))
+    return lines
+
+
+def string_pipeline(lines):
+    """The relay as it was: every chunk is JSON-decoded twice and encoded once"""
+    chunks = []
+    for line in lines:
+        data = json.loads(line.strip())
+        if data.get("event_type") == "text-generation":
+            text = data.get("text", "")
+            if text:
+                chunks.append(json.dumps({"response": text}))
+        elif data.get("event_type") == "stream-end":
+            break
+    chunks.append(json.dumps({"is_finished": True}))
+
+    full_response = ""
+    out = []
+    for chunk in chunks:
+        chunk_data = json.loads(chunk)
+        if "response" in chunk_data and chunk_data["response"]:
+            full_response += chunk_data["response"]
+            out.append(f"data: {chunk}\n\n".encode())
+        elif chunk_data.get("is_finished"):
+            out.append(f"data: {json.dumps({'is_finished': True, 'source_type': 'llm', 'sources': []})}\n\n".encode())
+            break
+    return full_response, out
+
+
+def event_pipeline(lines):
+    """The relay now: one decode per line, byte frames, a single join at the end"""
+    events = []
+    for line in lines:
+        event = parse_cohere_line(line)
+        if event is None:
+            continue
+        if event.kind == END:
+            break
+        events.append(event)
+
+    parts = []
+    out = []
+    for event in events:
+        if event.kind == TEXT:
+            parts.append(event.text)
+            out.append(text_frame(event.text))
+    out.append(frame({"is_finished": True, "source_type": "llm", "sources": []}))
+    return "".join(parts), out
+
+
+def cpu_ns_per_token(pipeline, lines, tokens: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time_ns()
+        pipeline(lines)
+        best = min(best, time.process_time_ns() - started)
+    return best / tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the SSE relay per token")
+    parser.add_argument("--tokens", type=int, default=2000, help="tokens per simulated reply")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per pipeline; the fastest is reported")
+    args = parser.parse_args()
+
+    lines = cohere_lines(args.tokens)
+    before_text, _ = string_pipeline(lines)
+    after_text, _ = event_pipeline(lines)
+    assert before_text == after_text, "pipelines disagree on the reply text"
+
+    before = cpu_ns_per_token(string_pipeline, lines, args.tokens, args.repeat)
+    after = cpu_ns_per_token(event_pipeline, lines, args.tokens, args.repeat)
+    print(f"JSON backend: {'orjson' if orjson is not None else 'json'}")
+    print(f"  string pipeline  {before:>10.0f} ns/token")
+    print(f"  event pipeline   {after:>10.0f} ns/token  ({(after - before) / before * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
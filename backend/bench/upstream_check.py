@@ -0,0 +1,117 @@
+"""Regression checks for the upstream gateway against an in-process mock transport.
+
+1. A half-open probe that ends without an outcome (request budget spent
+   waiting for a slot, or the caller cancelled) must not leave the circuit
+   rejecting every later call.
+2. With a queue of callers, the AIMD limit growing must also let more calls
+   run at once, not just raise the number.
+3. A streaming call whose body fails while the caller reads it is
+   recorded once (as answered), not as a success and then a failure.
+
+Usage (from the backend directory):
+    python -m bench.upstream_check
+"""
+import asyncio
+
+import httpx
+
+from http_client import AsyncHTTPClient
+from upstream import CircuitOpen, DeadlineExceeded, UpstreamGateway, request_deadline, start_request_budget
+
+
+def mock_client(handler) -> AsyncHTTPClient:
+    client = AsyncHTTPClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+async def check_abandoned_probe():
+    healthy = False
+
+    async def handler(request):
+        return httpx.Response(200 if healthy else 500)
+
+    gateway = UpstreamGateway("mock", default_timeout=5, client=mock_client(handler), max_retries=0)
+    gateway.breaker.cooldown = 0.05
+    for _ in range(gateway.breaker.threshold):
+        await gateway.request("GET", "http://upstream.test/")
+    assert gateway.breaker.state == "open", gateway.breaker.state
+    await asyncio.sleep(0.06)
+
+    # Probe 1: the request budget is already spent when it reaches the slot
+    start_request_budget(-1)
+    try:
+        await gateway.request("GET", "http://upstream.test/")
+    except DeadlineExceeded:
+        pass
+    request_deadline.set(None)
+
+    # Probe 2: cancelled while waiting for a slot
+    gateway.limiter.limit = 1
+    async with gateway.limiter.slot():
+        probe = asyncio.create_task(gateway.request("GET", "http://upstream.test/"))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+
+    healthy = True
+    try:
+        response = await gateway.request("GET", "http://upstream.test/")
+    except CircuitOpen:
+        raise AssertionError("circuit stuck half-open after an abandoned probe")
+    assert response.status_code == 200 and gateway.breaker.state == "closed"
+    print("abandoned probe: ok (next call probed and closed the circuit)")
+
+
+async def check_limit_growth(jobs: int = 400, initial: int = 2):
+    running = peak = 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.005)
+        running -= 1
+        return httpx.Response(200)
+
+    gateway = UpstreamGateway("mock", default_timeout=5, client=mock_client(handler), initial_limit=initial)
+    await asyncio.gather(*(gateway.request("GET", "http://upstream.test/") for _ in range(jobs)))
+    limit = int(gateway.limiter.limit)
+    assert peak > initial, f"peak in flight {peak} never rose above the initial limit {initial} (limit grew to {limit})"
+    print(f"limit growth: ok (limit {initial} -> {limit}, peak in flight {peak})")
+
+
+class BrokenBody(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"data: first\n\n"
+        raise httpx.ReadError("connection lost mid-body")
+
+
+async def check_stream_recorded_once():
+    async def handler(request):
+        return httpx.Response(200, stream=BrokenBody())
+
+    gateway = UpstreamGateway("mock", default_timeout=5, client=mock_client(handler))
+    recorded = []
+    record = gateway._record
+    gateway._record = lambda status_code: (recorded.append(status_code), record(status_code))
+    try:
+        async with gateway.stream("GET", "http://upstream.test/") as response:
+            async for _ in response.aiter_bytes():
+                pass
+    except httpx.ReadError:
+        pass
+    else:
+        raise AssertionError("the body error did not reach the caller")
+    assert recorded == [200], f"stream recorded as {recorded}"
+    print(f"stream body error: ok (recorded {recorded})")
+
+
+async def main():
+    await check_abandoned_probe()
+    await check_limit_growth()
+    await check_stream_recorded_once()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+# === History Search Settings ===
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+# Deep offsets make the text index score and sort ever more matches; past this, refine the query instead
+SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "500"))
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "2000"))
+
+_QUERY_TERM = re.compile(r'(-?)"([^"]+)"|(-?)(\w+)')
+_SUFFIXES = ("ing", "ies", "es", "ed", "s")
+
+
+def highlight_terms(query: str) -> List[str]:
+    """Words and phrases of a $text query worth highlighting (negated ones are not)"""
+    terms = []
+    for match in _QUERY_TERM.finditer(query.lower()):
+        phrase_negated, phrase, word_negated, word = match.groups()
+        if phrase and not phrase_negated:
+            terms.append(phrase)
+        elif word and not word_negated:
+            terms.append(word)
+    return terms
+
+
+def _stem(term: str) -> str:
+    # The text index stems words, so "running" matches "runs"; highlight on a shared prefix
+    for suffix in _SUFFIXES:
+        if term.endswith(suffix) and len(term) - len(suffix) >= 3:
+            return term[:-len(suffix)]
+    return term
+
+
+def highlight_pattern(terms: List[str]) -> Optional["re.Pattern"]:
+    if not terms:
+        return None
+    parts = [re.escape(_stem(term)) + r"\w*" if " " not in term else re.escape(term) for term in terms]
+    return re.compile(r"\b(?:" + "|".join(parts) + ")", re.IGNORECASE)
+
+
+def make_snippet(text: str, pattern: Optional["re.Pattern"], width: int = SEARCH_SNIPPET_CHARS) -> Tuple[str, List[List[int]]]:
+    """A window of the message around its densest run of matches, with [start, end) offsets of each match"""
+    matches = [m.span() for m in pattern.finditer(text)] if pattern is not None else []
+    if not matches:
+        snippet = text[:width]
+        return (snippet + "…" if len(text) > width else snippet), []
+
+    # Pick the window start (at a match) that covers the most matches
+    best_start, best_count = matches[0][0], 0
+    for i, (start, _) in enumerate(matches):
+        count = sum(1 for s, e in matches[i:] if e <= start + width)
+        if count > best_count:
+            best_start, best_count = start, count
+    start = max(0, best_start - width // 4)
+    while start > 0 and not text[start - 1].isspace() and best_start - start < width // 2:
+        start -= 1
+    end = min(len(text), start + width)
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    offset = len(prefix) - start
+    highlights = [[s + offset, e + offset] for s, e in matches if s >= start and e <= end]
+    return prefix + text[start:end] + suffix, highlights
+
+
+class HistorySearch:
+    """Ranked full-text search over one user's messages through the (username, message) text index"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def search(self, username: str, query: str, limit: int, offset: int = 0) -> Dict:
+        cursor = self.collection.find(
+            {"username": username, "$text": {"$search": query}},
+            {
+                "score": {"$meta": "textScore"},
+                "session_id": 1, "role": 1, "message": 1, "created_at": 1
+            }
+        ).sort([("score", {"$meta": "textScore"}), ("created_at", -1)]).skip(offset).limit(limit + 1)
+        cursor = cursor.max_time_ms(SEARCH_MAX_TIME_MS)
+        docs = await cursor.to_list(None)
+
+        pattern = highlight_pattern(highlight_terms(query))
+        hits = []
+        for doc in docs[:limit]:
+            snippet, highlights = make_snippet(doc["message"], pattern)
+            hits.append({
+                "message_id": str(doc["_id"]),
+                "session_id": doc["session_id"],
+                "role": doc["role"],
+                "created_at": doc["created_at"].isoformat(),
+                "score": round(doc["score"], 4),
+                "snippet": snippet,
+                "highlights": highlights,
+            })
+        next_offset = offset + limit if len(docs) > limit and offset + limit <= SEARCH_MAX_OFFSET else None
+        return {"query": query, "hits": hits, "next_offset": next_offset}
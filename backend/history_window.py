@@ -0,0 +1,168 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from write_behind import merge_pending
+
+# === Window Settings ===
+# Token budget for the verbatim turns sent to the LLM on every request
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Upper bound on documents read per turn, newest first via a reverse index scan
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "40"))
+# Older turns are folded into the rolling summary in batches of at most this many messages
+SUMMARY_BATCH_SIZE = int(os.getenv("SUMMARY_BATCH_SIZE", "200"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "2000"))
+# Compaction waits until the turns that fell out of the window reach either threshold, so a long
+# session is summarized every few turns instead of once per turn
+HISTORY_COMPACT_MIN_TURNS = int(os.getenv("HISTORY_COMPACT_MIN_TURNS", "8"))
+HISTORY_COMPACT_MIN_TOKENS = int(os.getenv("HISTORY_COMPACT_MIN_TOKENS", "1000"))
+
+ROLE_MAP = {"user": "USER", "assistant": "CHATBOT"}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; close enough for budgeting without a tokenizer
+    return len(text) // 4 + 1
+
+
+def to_cohere_turn(doc: dict) -> dict:
+    return {
+        "role": ROLE_MAP.get(doc["role"].lower(), doc["role"].upper()),
+        "message": doc["message"]
+    }
+
+
+def fit_to_budget(docs: List[dict], budget: int) -> List[dict]:
+    """Keep the newest turns (docs are oldest first) whose combined size fits the budget"""
+    kept = []
+    used = 0
+    for doc in reversed(docs):
+        cost = estimate_tokens(doc["message"])
+        if kept and used + cost > budget:
+            break
+        kept.append(doc)
+        used += cost
+    kept.reverse()
+    return kept
+
+
+def summary_prompt(previous_summary: str, turns: List[dict]) -> str:
+    transcript = "\n".join(f"{to_cohere_turn(t)['role'].capitalize()}: {t['message']}" for t in turns)
+    return (
+        "You maintain a running summary of a conversation between a user and an assistant.\n\n"
+        f"Current summary:\n{previous_summary or '(empty)'}\n\n"
+        f"New messages to fold in:\n{transcript}\n\n"
+        "Rewrite the summary so it covers everything above. Keep names, facts, decisions and open questions. "
+        f"Be concise (under {SUMMARY_MAX_CHARS} characters) and reply with the summary only."
+    )
+
+
+class HistoryWindow:
+    """Bounded LLM context: a rolling summary plus the most recent turns verbatim.
+
+    The summary and the created_at of the last message it covers (summary_until)
+    are stored on the session document and advanced in the background.
+    """
+
+    def __init__(self, messages, sessions, summarize: Callable[[str], Awaitable[str]],
+                 token_budget: int = HISTORY_TOKEN_BUDGET, max_turns: int = HISTORY_MAX_TURNS,
+                 pending: Optional[Callable[[str, str], List[dict]]] = None,
+                 compact_min_turns: int = HISTORY_COMPACT_MIN_TURNS,
+                 compact_min_tokens: int = HISTORY_COMPACT_MIN_TOKENS):
+        self.messages = messages
+        self.sessions = sessions
+        self.summarize = summarize
+        # Unflushed writes (see write_behind) to overlay on what the database returns
+        self.pending = pending
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.compact_min_turns = compact_min_turns
+        self.compact_min_tokens = compact_min_tokens
+        self.compactions = 0
+        self._compacting = set()
+        self._tasks = set()
+
+    async def load(self, session_id: str, username: str) -> Tuple[List[dict], Optional[datetime]]:
+        """Return (chat_history for the LLM, created_at of the oldest verbatim turn)"""
+        session = await self.sessions.find_one(
+            {"username": username, "session_id": session_id},
+            {"_id": 0, "summary": 1, "summary_until": 1}
+        ) or {}
+        query = {"session_id": session_id, "username": username}
+        if session.get("summary_until"):
+            query["created_at"] = {"$gt": session["summary_until"]}
+
+        # Read past the window by the compaction threshold so the overflow can be measured
+        limit = self.max_turns + self.compact_min_turns
+        recent = await self.messages.find(
+            query,
+            {"_id": 1, "role": 1, "message": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(limit).to_list(None)
+        recent.reverse()
+        if self.pending is not None:
+            recent = merge_pending(recent, self.pending(username, session_id))[-limit:]
+
+        kept = fit_to_budget(recent[-self.max_turns:], self.token_budget)
+        history = [to_cohere_turn(doc) for doc in kept]
+        if session.get("summary"):
+            history.insert(0, {"role": "SYSTEM", "message": f"Summary of the earlier conversation: {session['summary']}"})
+
+        # Unsummarized turns older than the oldest kept one are due for compaction once there are enough
+        # of them; a full read means there are at least compact_min_turns
+        boundary = None
+        overflow = recent[:len(recent) - len(kept)]
+        if kept and overflow and (
+            len(overflow) >= self.compact_min_turns
+            or sum(estimate_tokens(doc["message"]) for doc in overflow) >= self.compact_min_tokens
+        ):
+            boundary = kept[0]["created_at"]
+        return history, boundary
+
+    def schedule_compaction(self, session_id: str, username: str, boundary: Optional[datetime]):
+        if boundary is None or (username, session_id) in self._compacting:
+            return
+        task = asyncio.create_task(self.compact(session_id, username, boundary))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def compact(self, session_id: str, username: str, boundary: datetime):
+        """Fold messages older than boundary into the session's rolling summary"""
+        key = (username, session_id)
+        self._compacting.add(key)
+        try:
+            session = await self.sessions.find_one(
+                {"username": username, "session_id": session_id},
+                {"_id": 0, "summary": 1, "summary_until": 1}
+            )
+            if session is None:
+                return
+            previous_until = session.get("summary_until")
+            created_at = {"$lt": boundary}
+            if previous_until:
+                created_at["$gt"] = previous_until
+
+            turns = await self.messages.find(
+                {"session_id": session_id, "username": username, "created_at": created_at},
+                {"_id": 0, "role": 1, "message": 1, "created_at": 1}
+            ).sort("created_at", 1).limit(SUMMARY_BATCH_SIZE).to_list(None)
+            if not turns:
+                return
+
+            self.compactions += 1
+            summary = (await self.summarize(summary_prompt(session.get("summary", ""), turns))).strip()
+            if not summary or summary == "[LLM error]":
+                return
+
+            # Only advance if nobody else moved the summary while we were waiting on the LLM
+            await self.sessions.update_one(
+                {"username": username, "session_id": session_id, "summary_until": previous_until},
+                {"$set": {"summary": summary[:SUMMARY_MAX_CHARS], "summary_until": turns[-1]["created_at"]}}
+            )
+        except Exception as e:
+            print(f"Error compacting history for session {session_id}: {e}")
+        finally:
+            self._compacting.discard(key)
+
+    def stats(self) -> dict:
+        return {"compacting": len(self._compacting), "compactions": self.compactions}
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+# === Connection Pool Settings ===
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "500"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "100"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Streaming replies can pause between tokens, so the read timeout is per chunk, not per request
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "200"))
+
+
+def parse_host_limits(raw: str) -> Dict[str, int]:
+    """Parse "api.cohere.ai=200,serpapi.com=20" into a host -> limit map"""
+    limits = {}
+    for item in raw.split(","):
+        host, _, value = item.partition("=")
+        if host.strip() and value.strip():
+            limits[host.strip().lower()] = int(value)
+    return limits
+
+
+HTTP_HOST_LIMITS = parse_host_limits(os.getenv("HTTP_HOST_LIMITS", ""))
+
+
+class AsyncHTTPClient:
+    """Shared keep-alive connection pool with a concurrency cap per upstream host.
+
+    The caps are meant for the handful of API hosts we call. Fetches of
+    arbitrary URLs pass per_host=False: a semaphore kept for every domain
+    ever fetched would grow without bound.
+    """
+
+    def __init__(self, host_limits: Optional[Dict[str, int]] = None, default_limit: int = HTTP_PER_HOST_LIMIT):
+        self.host_limits = dict(HTTP_HOST_LIMITS if host_limits is None else host_limits)
+        self.default_limit = default_limit
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+        return self._client
+
+    def _semaphore(self, url: str) -> asyncio.Semaphore:
+        host = (urlsplit(url).hostname or "").lower()
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.host_limits.get(host, self.default_limit))
+        return self._semaphores[host]
+
+    async def request(self, method: str, url: str, per_host: bool = True, **kwargs) -> httpx.Response:
+        async with self._semaphore(url) if per_host else nullcontext():
+            return await self.client.request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, per_host: bool = True, **kwargs) -> AsyncIterator[httpx.Response]:
+        # The host slot is held until the caller has finished reading the body
+        async with self._semaphore(url) if per_host else nullcontext():
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+http = AsyncHTTPClient()
@@ -0,0 +1,332 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from pymongo import ReplaceOne, UpdateOne
+
+from storage import acquire_lock, batch_key, bulk_write_once, release_lock, update_once
+
+# === Insights Settings ===
+# Opt-in: every persisted batch then also writes two rollup collections
+INSIGHTS_ENABLED = os.getenv("INSIGHTS_ENABLED", "0") == "1"
+INSIGHTS_TOP_DOMAINS = int(os.getenv("INSIGHTS_TOP_DOMAINS", "10"))
+INSIGHTS_MAX_DAYS = int(os.getenv("INSIGHTS_MAX_DAYS", "366"))
+# Periodic rebuild of the closed days from chat_history; 0 only rebuilds on demand or into an empty store
+INSIGHTS_COMPACT_INTERVAL = float(os.getenv("INSIGHTS_COMPACT_INTERVAL", "0"))
+INSIGHTS_BATCH_SIZE = int(os.getenv("INSIGHTS_BATCH_SIZE", "1000"))
+# Messages whose live update failed are flagged insights_pending and recorded by this sweep
+INSIGHTS_SWEEP_INTERVAL = float(os.getenv("INSIGHTS_SWEEP_INTERVAL", "60"))
+# Lease of the lock that lets one worker at a time rebuild or sweep
+INSIGHTS_LOCK_SECONDS = float(os.getenv("INSIGHTS_LOCK_SECONDS", "1800"))
+INSIGHTS_LOCK = "insights"
+
+# Mongo treats dots in a field name as a path, so domain keys use a lookalike character
+_DOT, _DOT_SUBSTITUTE = ".", "．"
+
+Scope = Optional[str]  # a username, or None for the totals over all users
+
+
+def day_of(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d")
+
+
+def domain_of(url: str) -> Optional[str]:
+    try:
+        host = (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return None
+    return host[4:] if host.startswith("www.") else host or None
+
+
+def message_counters(doc: dict) -> Counter:
+    """Rollup increments contributed by one chat_history document"""
+    counters = Counter(messages=1)
+    if doc["role"] == "assistant":
+        counters["assistant_messages"] += 1
+        counters["response_chars"] += len(doc.get("message") or "")
+        counters[f"flows.{doc.get('source_type') or 'llm'}"] += 1
+        for url in doc.get("sources") or ():
+            domain = domain_of(url)
+            if domain:
+                counters["domains." + domain.replace(_DOT, _DOT_SUBSTITUTE)] += 1
+    else:
+        counters["user_messages"] += 1
+    return counters
+
+
+def _scopes(username: str) -> Tuple[Scope, Scope]:
+    return username, None
+
+
+def _totals_id(scope: Scope) -> dict:
+    return {"u": scope}
+
+
+def _daily_id(scope: Scope, day: str) -> dict:
+    return {"u": scope, "d": day}
+
+
+class Insights:
+    """Materialized per-user and global rollups, per day and in total.
+
+    record() folds every batch of persisted messages into the rollups with
+    $inc upserts, so reads are a handful of _id lookups whatever the size of
+    chat_history. rebuild() is the compactor: it recomputes all closed days
+    (before today, UTC) from the raw log and moves the totals by what that
+    changed, repairing any drift. sweep() records the messages whose live
+    update failed. Rebuilds and sweeps hold a lock document in `locks`, so
+    one worker at a time runs them.
+    """
+
+    def __init__(self, daily, totals, log, locks):
+        self.daily = daily
+        self.totals = totals
+        self.log = log
+        self.locks = locks
+        self._task = None
+        self.rebuilds = 0
+        self.last_rebuild: Optional[datetime] = None
+        self.swept = 0
+
+    async def record(self, docs: Iterable[dict], new_sessions: Iterable[dict] = ()):
+        """Apply persisted messages and the first message of every newly created session.
+
+        Every rollup update is keyed by the messages it counts, so recording
+        a retried batch again leaves the rollups it already reached alone.
+        """
+        daily: Dict[Tuple[Scope, str], Counter] = {}
+        totals: Dict[Scope, Counter] = {}
+        daily_docs: Dict[Tuple[Scope, str], List[dict]] = {}
+        totals_docs: Dict[Scope, List[dict]] = {}
+
+        def add(doc: dict, counters: Counter, counted: bool):
+            day = day_of(doc["created_at"])
+            for scope in _scopes(doc["username"]):
+                daily.setdefault((scope, day), Counter()).update(counters)
+                totals.setdefault(scope, Counter()).update(counters)
+                if counted:
+                    daily_docs.setdefault((scope, day), []).append(doc)
+                    totals_docs.setdefault(scope, []).append(doc)
+
+        for doc in docs:
+            add(doc, message_counters(doc), True)
+        for doc in new_sessions:
+            add(doc, Counter(sessions=1), False)
+
+        operations = [
+            update_once({"_id": _daily_id(scope, day)}, {"$inc": dict(counters)}, batch_key(daily_docs[scope, day]))
+            for (scope, day), counters in daily.items()
+        ]
+        if operations:
+            await bulk_write_once(self.daily, operations)
+            await bulk_write_once(self.totals, [
+                update_once({"_id": _totals_id(scope)}, {"$inc": dict(counters)}, batch_key(totals_docs[scope]))
+                for scope, counters in totals.items()
+            ])
+
+    async def summary(self, username: Scope = None) -> dict:
+        doc = await self.totals.find_one({"_id": _totals_id(username)})
+        return self._format(doc or {})
+
+    async def daily_series(self, username: Scope = None, days: int = 30) -> List[dict]:
+        today = datetime.utcnow()
+        ids = [_daily_id(username, day_of(today - timedelta(days=offset))) for offset in range(days)]
+        docs = await self.daily.find({"_id": {"$in": ids}}).to_list(None)
+        series = [dict(self._format(doc), day=doc["_id"]["d"]) for doc in docs]
+        return sorted(series, key=lambda item: item["day"])
+
+    def _format(self, doc: dict) -> dict:
+        messages = doc.get("messages", 0)
+        sessions = doc.get("sessions", 0)
+        assistant = doc.get("assistant_messages", 0)
+        domains = sorted(
+            ((field.replace(_DOT_SUBSTITUTE, _DOT), count) for field, count in (doc.get("domains") or {}).items()),
+            key=lambda item: item[1], reverse=True
+        )[:INSIGHTS_TOP_DOMAINS]
+        return {
+            "messages": messages,
+            "user_messages": doc.get("user_messages", 0),
+            "assistant_messages": assistant,
+            "sessions": sessions,
+            "flows": doc.get("flows", {}),
+            "average_response_chars": round(doc.get("response_chars", 0) / assistant, 1) if assistant else 0,
+            "average_session_length": round(messages / sessions, 2) if sessions else 0,
+            "top_domains": [{"domain": domain, "count": count} for domain, count in domains],
+        }
+
+    # === Compactor ===
+    async def rebuild(self, username: Scope = None) -> bool:
+        """Recompute the closed days from chat_history (for one user, or everything) and the totals.
+
+        Returns False when another worker holds the lock.
+        """
+        owner = await acquire_lock(self.locks, INSIGHTS_LOCK, INSIGHTS_LOCK_SECONDS)
+        if owner is None:
+            print(f"Insights rebuild for {username or 'all users'} skipped: another worker holds the lock")
+            return False
+        try:
+            await self._rebuild(username)
+        finally:
+            await release_lock(self.locks, INSIGHTS_LOCK, owner)
+        return True
+
+    async def _rebuild(self, username: Scope):
+        today = day_of(datetime.utcnow())
+        cutoff = datetime.strptime(today, "%Y-%m-%d")
+        query = {"created_at": {"$lt": cutoff}}
+        if username is not None:
+            query["username"] = username
+
+        daily: Dict[Tuple[Scope, str], Counter] = {}
+        # Only the first timestamp of each session: the log can be far larger than memory
+        session_start: Dict[Tuple[str, str], datetime] = {}
+        cursor = self.log.find(
+            query, {"username": 1, "session_id": 1, "role": 1, "message": 1, "source_type": 1, "sources": 1, "created_at": 1}
+        ).batch_size(INSIGHTS_BATCH_SIZE)
+        async for doc in cursor:
+            scopes = _scopes(doc["username"]) if username is None else (username,)
+            counters = message_counters(doc)
+            day = day_of(doc["created_at"])
+            for scope in scopes:
+                daily.setdefault((scope, day), Counter()).update(counters)
+            key = (doc["username"], doc["session_id"])
+            if key not in session_start or doc["created_at"] < session_start[key]:
+                session_start[key] = doc["created_at"]
+        for (owner, _), started in session_start.items():
+            scopes = _scopes(owner) if username is None else (username,)
+            for scope in scopes:
+                daily.setdefault((scope, day_of(started)), Counter())["sessions"] += 1
+
+        # The closed days as they were, to move the totals by the difference only
+        closed = {"_id.d": {"$lt": today}}
+        if username is not None:
+            closed["_id.u"] = username
+        previous: Dict[Scope, Counter] = {}
+        async for doc in self.daily.find(closed).batch_size(INSIGHTS_BATCH_SIZE):
+            previous.setdefault(doc["_id"]["u"], Counter()).update(self._flatten(doc))
+
+        await self.daily.delete_many(closed)
+        if daily:
+            await self.daily.bulk_write([
+                ReplaceOne({"_id": _daily_id(scope, day)}, self._nest(counters), upsert=True)
+                for (scope, day), counters in daily.items()
+            ], ordered=False)
+
+        # $inc rather than a replace: live updates landing meanwhile keep their counts
+        rebuilt: Dict[Scope, Counter] = {}
+        for (scope, _), counters in daily.items():
+            rebuilt.setdefault(scope, Counter()).update(counters)
+        operations = []
+        for scope in set(rebuilt) | set(previous):
+            new, old = rebuilt.get(scope, Counter()), previous.get(scope, Counter())
+            delta = {key: new[key] - old[key] for key in set(new) | set(old) if new[key] != old[key]}
+            if delta:
+                operations.append(UpdateOne({"_id": _totals_id(scope)}, {"$inc": delta}, upsert=True))
+        if operations:
+            await self.totals.bulk_write(operations, ordered=False)
+        # The rebuilt days already count these; the sweep must not count them again
+        await self.log.update_many(dict(query, insights_pending=True), {"$unset": {"insights_pending": ""}})
+
+        self.rebuilds += 1
+        self.last_rebuild = datetime.utcnow()
+        print(f"Insights rebuilt for {username or 'all users'}: {len(daily)} day rollups")
+
+    async def sweep(self) -> int:
+        """Record messages flagged insights_pending by a failed live update; returns how many"""
+        if await self.log.find_one({"insights_pending": True}, {"_id": 1}) is None:
+            return 0
+        owner = await acquire_lock(self.locks, INSIGHTS_LOCK, INSIGHTS_LOCK_SECONDS)
+        if owner is None:
+            return 0
+        try:
+            docs = await self.log.find(
+                {"insights_pending": True},
+                {"username": 1, "session_id": 1, "role": 1, "message": 1, "source_type": 1, "sources": 1, "created_at": 1}
+            ).sort("created_at", 1).limit(INSIGHTS_BATCH_SIZE).to_list(None)
+            new_sessions = []
+            for doc in docs:
+                first = await self.log.find(
+                    {"username": doc["username"], "session_id": doc["session_id"]}, {"_id": 1}
+                ).sort([("created_at", 1), ("_id", 1)]).limit(1).to_list(1)
+                if first and first[0]["_id"] == doc["_id"]:
+                    new_sessions.append(doc)
+            await self.record(docs, new_sessions)
+            await self.log.update_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, {"$unset": {"insights_pending": ""}})
+        finally:
+            await release_lock(self.locks, INSIGHTS_LOCK, owner)
+        self.swept += len(docs)
+        return len(docs)
+
+    @staticmethod
+    def _nest(counters: Counter) -> dict:
+        doc = {}
+        for key, value in counters.items():
+            group, _, field = key.partition(".")
+            if field:
+                doc.setdefault(group, {})[field] = value
+            else:
+                doc[key] = value
+        return doc
+
+    @staticmethod
+    def _flatten(doc: dict) -> Counter:
+        counters = Counter()
+        for key, value in doc.items():
+            if key in ("_id", "applied_batches"):
+                continue
+            if isinstance(value, dict):
+                counters.update({f"{key}.{field}": count for field, count in value.items()})
+            else:
+                counters[key] += value
+        return counters
+
+    def schedule_rebuild(self, username: Scope = None):
+        if self._task is not None and not self._task.done():
+            return False
+        self._task = asyncio.create_task(self._safe_rebuild(username))
+        return True
+
+    async def _safe_rebuild(self, username: Scope = None):
+        try:
+            await self.rebuild(username)
+        except Exception as e:
+            print(f"Insights rebuild failed: {e}")
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(INSIGHTS_COMPACT_INTERVAL)
+            await self._safe_rebuild()
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(INSIGHTS_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Insights sweep failed: {e}")
+
+    async def start(self):
+        # An empty store next to an existing log (first deploy) is backfilled once, by whichever worker gets the lock
+        if await self.totals.find_one({"_id": _totals_id(None)}) is None:
+            self.schedule_rebuild()
+        self._periodic = []
+        if INSIGHTS_COMPACT_INTERVAL > 0:
+            self._periodic.append(asyncio.create_task(self._compact_periodically()))
+        if INSIGHTS_SWEEP_INTERVAL > 0:
+            self._periodic.append(asyncio.create_task(self._sweep_periodically()))
+
+    async def stop(self):
+        for task in [self._task] + getattr(self, "_periodic", []):
+            if task is not None and not task.done():
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "rebuilds": self.rebuilds,
+            "last_rebuild": self.last_rebuild.isoformat() if self.last_rebuild else None,
+            "rebuilding": self._task is not None and not self._task.done(),
+            "swept": self.swept,
+        }
@@ -0,0 +1,171 @@
+import json
+import math
+import os
+import re
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# === Intent Router Settings ===
+# Optional JSON file overriding the cue lists below; re-read when its mtime changes
+INTENT_CONFIG_PATH = os.getenv("INTENT_CONFIG_PATH", "")
+INTENT_RELOAD_SECONDS = float(os.getenv("INTENT_RELOAD_SECONDS", "5"))
+# Fall back to the local Naive Bayes classifier when no cue matches at all
+INTENT_CLASSIFIER_ENABLED = os.getenv("INTENT_CLASSIFIER_ENABLED", "0") == "1"
+INTENT_CLASSIFIER_THRESHOLD = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD", "0.75"))
+WEB_SCORE_THRESHOLD = float(os.getenv("INTENT_WEB_THRESHOLD", "0.5"))
+
+DEFAULT_CONFIG = {
+    "cutoff_year": 2022,
+    # Regex fragments, matched case-insensitively
+    "greeting": [
+        r"\bhi\b", r"\bhello\b", r"\bhey\b", r"good (?:morning|afternoon|evening|night)",
+        r"how are you\??", r"what'?s up\??", r"how'?s it going\??"
+    ],
+    # Plain phrases, matched at a word start
+    "recency": [
+        "today", "yesterday", "breaking", "currently", "latest", "last week", "last month",
+        "this week", "this month", "just happened", "right now", "live",
+        "update", "recent", "ongoing", "news", "recently"
+    ],
+    "search": ["search for", "look up", "google", "find online", "sources for", "search the web"],
+    # Weight each matched cue contributes to the web score (combined as 1 - prod(1 - w))
+    "weights": {"recency": 0.6, "year": 0.8, "search": 1.0},
+    # Seed examples for the optional classifier
+    "examples": {
+        "web": [
+            "who won the game", "what is the price of bitcoin", "weather in london",
+            "election results", "stock price of apple", "score of the match",
+            "when is the next launch", "who is the current prime minister"
+        ],
+        "llm": [
+            "explain how photosynthesis works", "write a poem about the sea", "what is recursion",
+            "how do i reverse a list in python", "summarize the causes of world war one",
+            "give me a recipe for pancakes", "what does this error mean", "translate hello to french"
+        ]
+    }
+}
+
+
+class Route(NamedTuple):
+    flow: str          # "greeting", "web" or "llm"
+    score: float       # confidence for the chosen flow, 0..1
+    cues: Tuple[str, ...]
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+class NaiveBayes:
+    """Tiny multinomial Naive Bayes over word unigrams, trained from the config examples"""
+
+    def __init__(self, examples: Dict[str, List[str]]):
+        self.labels = list(examples)
+        self.counts = {label: {} for label in self.labels}
+        self.totals = {label: 0 for label in self.labels}
+        vocabulary = set()
+        for label, texts in examples.items():
+            for text in texts:
+                for token in _tokens(text):
+                    self.counts[label][token] = self.counts[label].get(token, 0) + 1
+                    self.totals[label] += 1
+                    vocabulary.add(token)
+        self.vocabulary_size = max(len(vocabulary), 1)
+        total_docs = sum(len(texts) for texts in examples.values()) or 1
+        self.priors = {label: math.log(max(len(examples[label]), 1) / total_docs) for label in self.labels}
+
+    def probability(self, text: str, label: str) -> float:
+        scores = {}
+        for candidate in self.labels:
+            score = self.priors[candidate]
+            denominator = self.totals[candidate] + self.vocabulary_size
+            for token in _tokens(text):
+                score += math.log((self.counts[candidate].get(token, 0) + 1) / denominator)
+            scores[candidate] = score
+        top = max(scores.values())
+        exp = {candidate: math.exp(score - top) for candidate, score in scores.items()}
+        return exp.get(label, 0.0) / sum(exp.values())
+
+
+class IntentRouter:
+    """Single-pass router: one precompiled alternation regex covers every cue category"""
+
+    def __init__(self, config_path: str = INTENT_CONFIG_PATH, classifier: bool = INTENT_CLASSIFIER_ENABLED):
+        self.config_path = config_path
+        self.use_classifier = classifier
+        self._mtime = None
+        self._checked_at = 0.0
+        self._load(DEFAULT_CONFIG)
+        self.maybe_reload(force=True)
+
+    def _load(self, overrides: dict):
+        config = dict(DEFAULT_CONFIG, **overrides)
+        self.cutoff_year = int(config["cutoff_year"])
+        self.weights = dict(DEFAULT_CONFIG["weights"], **config.get("weights", {}))
+        groups = [
+            ("greeting", "|".join(f"(?:{p})" for p in config["greeting"])),
+            ("recency", r"\b(?:" + "|".join(re.escape(k) for k in config["recency"]) + ")"),
+            ("year", r"\b20\d{2}\b"),
+            ("search", r"\b(?:" + "|".join(re.escape(k) for k in config["search"]) + ")"),
+        ]
+        self.pattern = re.compile("|".join(f"(?P<{name}>{body})" for name, body in groups if body), re.IGNORECASE)
+        self.classifier = NaiveBayes(config["examples"]) if self.use_classifier else None
+
+    def maybe_reload(self, force: bool = False):
+        if not self.config_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < INTENT_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.config_path)
+            if mtime == self._mtime:
+                return
+            with open(self.config_path) as f:
+                overrides = json.load(f)
+            self._load(overrides)
+            self._mtime = mtime
+            print(f"Intent router reloaded cues from {self.config_path}")
+        except (OSError, ValueError, re.error) as e:
+            # Keep the previous automaton if the new config is unreadable
+            print(f"Intent router config {self.config_path} not loaded: {e}")
+
+    def route(self, message: str) -> Route:
+        self.maybe_reload()
+        cues = []
+        greeting = False
+        miss_web = 1.0
+        for match in self.pattern.finditer(message):
+            kind = match.lastgroup
+            if kind == "greeting":
+                greeting = True
+            elif kind == "year":
+                if int(match.group()) <= self.cutoff_year:
+                    continue
+                miss_web *= 1 - self.weights["year"]
+            else:
+                miss_web *= 1 - self.weights[kind]
+            cues.append(f"{kind}:{match.group().lower()}")
+        web_score = 1 - miss_web
+
+        if web_score >= WEB_SCORE_THRESHOLD:
+            return Route("web", round(web_score, 3), tuple(cues))
+        if greeting:
+            return Route("greeting", round(1 - web_score, 3), tuple(cues))
+        if self.classifier is not None and not cues:
+            p_web = self.classifier.probability(message, "web")
+            if p_web >= INTENT_CLASSIFIER_THRESHOLD:
+                return Route("web", round(p_web, 3), ("classifier",))
+            return Route("llm", round(1 - p_web, 3), ("classifier",))
+        return Route("llm", round(1 - web_score, 3), tuple(cues))
+
+
+_default_router: Optional[IntentRouter] = None
+
+
+def default_router() -> IntentRouter:
+    global _default_router
+    if _default_router is None:
+        _default_router = IntentRouter()
+    return _default_router
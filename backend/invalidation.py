@@ -0,0 +1,128 @@
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from storage import AsyncCollection
+
+# === Invalidation Settings ===
+# "local": in-process only (single worker); "mongo": fan out through a change stream on the
+# `invalidations` collection so every worker and node applies the same invalidations
+INVALIDATION_BACKEND = os.getenv("INVALIDATION_BACKEND", "local")
+INVALIDATION_RETRY_SECONDS = float(os.getenv("INVALIDATION_RETRY_SECONDS", "2"))
+
+
+class InvalidationBus:
+    """Topic pub/sub for cache invalidation across workers.
+
+    Handlers run in the publishing worker immediately and in every other
+    worker when the event arrives through the change stream. Change streams
+    need MongoDB running as a replica set (a single-node one is enough).
+    """
+
+    def __init__(self, collection=None):
+        self.collection = collection
+        self.worker_id = None
+        self._handlers: Dict[str, List[Callable]] = {}
+        self._task = None
+        self._closing = False
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, topic: str, handler: Callable):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def _deliver(self, topic: str, payload: dict):
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(**payload)
+            except Exception as e:
+                print(f"Invalidation handler for {topic} failed: {e}")
+
+    async def publish(self, topic: str, **payload):
+        self._deliver(topic, payload)
+        self.published += 1
+        if self.collection is not None:
+            await self.collection.insert_one({
+                "topic": topic,
+                "payload": payload,
+                "origin": self.worker_id,
+                "created_at": datetime.utcnow()
+            })
+
+    def start(self):
+        # Identity is taken at startup, i.e. after any fork, so each worker has its own
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        if self.collection is not None and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_change(self, change: dict):
+        doc = change.get("fullDocument") or {}
+        if doc.get("origin") == self.worker_id:
+            return
+        self.received += 1
+        self._deliver(doc.get("topic", ""), doc.get("payload", {}))
+
+    async def _listen(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while not self._closing:
+            try:
+                if isinstance(self.collection, AsyncCollection):
+                    await self._listen_in_thread(pipeline)
+                else:
+                    async with self.collection.watch(pipeline) as stream:
+                        async for change in stream:
+                            self._on_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Invalidation change stream interrupted, reconnecting: {e}")
+            await asyncio.sleep(INVALIDATION_RETRY_SECONDS)
+
+    async def _listen_in_thread(self, pipeline):
+        """Tail the change stream with pymongo on a daemon thread (thread-offload backend)"""
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def finish(error=None):
+            if done.done():
+                return
+            if error is not None:
+                done.set_exception(error)
+            else:
+                done.set_result(None)
+
+        def tail():
+            try:
+                with self.collection.delegate.watch(pipeline, max_await_time_ms=1000) as stream:
+                    while not self._closing and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            loop.call_soon_threadsafe(self._on_change, change)
+                loop.call_soon_threadsafe(finish)
+            except Exception as e:
+                loop.call_soon_threadsafe(finish, e)
+
+        threading.Thread(target=tail, name="invalidation-tail", daemon=True).start()
+        await done
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "mongo" if self.collection is not None else "local",
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "received": self.received,
+        }
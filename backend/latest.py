@@ -1,14 +1,17 @@
+import os
 import requests
 
+from intent import default_router
+
 # --- Configuration ---
 
 # SERP API Config
 SERP_API_KEY = "68ad7d52c518c9e05af9698a722827845c34a11c0771ab5e97099427c64f609a"  # Replace this with your actual SERP API key
-SERP_API_URL = "https://serpapi.com/search"
+SERP_API_URL = os.getenv("SERP_API_URL", "https://serpapi.com/search")
 
 # Cohere API Config
 COHERE_API_KEY = "sNvH7BXlEGHdhomPtEalgqEGRJZiQxnMEEV2pEsX"
-COHERE_API_URL = "https://api.cohere.ai/v1/chat"
+COHERE_API_URL = os.getenv("COHERE_API_URL", "https://api.cohere.ai/v1/chat")
 HEADERS = {
     "Authorization": f"Bearer {COHERE_API_KEY}",
     "Content-Type": "application/json"
@@ -55,24 +58,9 @@ def ask_gpt(prompt):
         return "[Error from LLM]"
 
 # --- Decide if the Query Needs Web Search ---
+# Local cue matching (plus the optional classifier) instead of a yes/no LLM round-trip
 def needs_web_search(query):
-    check_prompt = (
-        f"Is the following question about a current or recent event that would require up-to-date "
-        f"information from the internet? Respond only with 'yes' or 'no'.\n\nQuestion: {query}"
-    )
-    payload = {
-        "message": check_prompt,
-        "model": "command-r-plus",
-        "temperature": 0,
-        "max_tokens": 10
-    }
-    response = requests.post(COHERE_API_URL, json=payload, headers=HEADERS)
-    if response.status_code == 200:
-        answer = response.json().get("text", "").strip().lower()
-        return answer.startswith("yes")
-    else:
-        print("Error in needs_web_search:", response.status_code, response.text)
-        return False
+    return default_router().route(query).flow == "web"
 
 # --- Main Logic ---
 def get_answer(query):
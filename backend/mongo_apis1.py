@@ -1,20 +1,47 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Query, Header, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import List, Dict, AsyncGenerator
-import requests
-import json
-import re
-from passlib.context import CryptContext
-from pymongo import MongoClient
+from typing import List, Dict, AsyncGenerator, Optional
+import asyncio
+import httpx
+from contextlib import aclosing
+import os
+import time
 from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import OperationFailure
 from fastapi.middleware.cors import CORSMiddleware
+from http_client import HTTP_READ_TIMEOUT, http
+from storage import bulk_write_once, batch_key, connect_database, close_database, ensure_indexes, insert_new, update_once
+from history_window import HistoryWindow
+from write_behind import WRITE_BEHIND_ENABLED, WriteBehindQueue, merge_pending
+from search_cache import SEARCH_CACHE_SHARED, SearchCache, normalize_query
+from singleflight import SingleFlight, StreamFlight, flight_key
+from response_cache import RESPONSE_CACHE_ENABLED, ResponseCache, replay_chunks
+from pipeline import SpeculativeSearch
+from telemetry import DEBUG_ENABLED, REGISTRY, RequestTrace, debug
+from intent import default_router
+from invalidation import INVALIDATION_BACKEND, InvalidationBus
+from auth_pool import AUTH_RETRY_AFTER_SECONDS, PasswordHasher, PoolSaturated, SessionTokens
+from sse import (
+    END, ERROR, FINISHED, TEXT, ClientDisconnected, DisconnectWatch, FlushPolicy, StreamEvent,
+    coalesce_events, dumps, frame, parse_cohere_line, text_frame
+)
+from history_search import SEARCH_MAX_LIMIT, SEARCH_MAX_OFFSET, HistorySearch
+from insights import INSIGHTS_ENABLED, INSIGHTS_MAX_DAYS, Insights
+from batch import BATCH_MAX_ITEMS, BatchFull, BatchRunner, BatchStore, ProviderLimits, summary_of
+from transfer import TransferReport, export_lines, export_query, gzip_chunks, import_lines, ndjson_lines
+from pagination import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT, etag_for, etag_matches, fetch_page, overlay_newest, page_headers
+from retrieval import RETRIEVAL_ENABLED, RETRIEVAL_TOP_K, Retriever
+from resumable import RESUMABLE_STREAMS_ENABLED, ResumableStreams
+from upstream import UpstreamError, UpstreamGateway, request_deadline, start_request_budget
 
 # === API KEYS & URLs ===
-COHERE_API_KEY = "COHERE_API_KEY "
-COHERE_API_URL = "https://api.cohere.ai/v1/chat"
-SERP_API_KEY = "SERP_API_KEY"
-SERP_API_URL = "https://serpapi.com/search"
+COHERE_API_KEY = os.getenv("COHERE_API_KEY", "")
+COHERE_API_URL = os.getenv("COHERE_API_URL", "https://api.cohere.ai/v1/chat")
+SERP_API_KEY = os.getenv("SERP_API_KEY", "")
+SERP_API_URL = os.getenv("SERP_API_URL", "https://serpapi.com/search")
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",") if o.strip()]
 
 HEADERS = {
     "Authorization": f"Bearer {COHERE_API_KEY}",
@@ -22,9 +49,11 @@ HEADERS = {
 }
 
 # === MongoDB Configuration ===
-client = MongoClient("mongodb://localhost:27017")
-db = client["chatdb"]
+# Async handle (Motor or thread-offloaded pymongo, see storage.MONGO_BACKEND).
+# Connections are opened lazily, so every worker process gets its own pool.
+db = connect_database()
 collection = db["chat_history"]
+session_collection = db["sessions"]
 user_collection = db["users"]
 
 # === FastAPI App ===
@@ -32,12 +61,35 @@ app = FastAPI()
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:3000"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Before-Cursor", "X-After-Cursor"],
 )
 
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes(db)
+    invalidation_bus.start()
+    if write_queue is not None:
+        write_queue.start()
+    if insights is not None:
+        await insights.start()
+
+@app.on_event("shutdown")
+async def close_clients():
+    # Flush buffered chat messages before the database handle goes away
+    if write_queue is not None:
+        await write_queue.drain()
+    await invalidation_bus.stop()
+    await batch_runner.stop()
+    if insights is not None:
+        await insights.stop()
+    await http.aclose()
+    password_hasher.shutdown()
+    close_database(db)
+
 # === Models ===
 class ChatRequest(BaseModel):
     session_id: str
@@ -49,24 +101,113 @@ class UserCredentials(BaseModel):
     password: str
 
 # === Helper Functions ===
-def get_chat_history(session_id: str, username: str) -> List[dict]:
+async def get_chat_history(session_id: str, username: str) -> List[dict]:
     history_cursor = collection.find(
         {"session_id": session_id, "username": username},
-        {"_id": 0, "role": 1, "message": 1}
+        {"_id": 1, "role": 1, "message": 1, "created_at": 1}
     ).sort("created_at", 1)
+    history_docs = await history_cursor.to_list(None)
+    if write_queue is not None:
+        history_docs = merge_pending(history_docs, write_queue.pending_for(username, session_id))
+    return [to_api_message(doc) for doc in history_docs]
 
-    role_map = {"user": "USER", "assistant": "CHATBOT"}
-    return [
-        {
-            "role": role_map.get(doc["role"].lower(), doc["role"].upper()),
-            "message": doc["message"]
-        }
-        for doc in history_cursor
-    ]
 
+ROLE_MAP = {"user": "USER", "assistant": "CHATBOT"}
+
+def to_api_message(doc: dict) -> dict:
+    return {
+        "role": ROLE_MAP.get(doc["role"].lower(), doc["role"].upper()),
+        "message": doc["message"]
+    }
+
+
+def json_with_etag(body, if_none_match: Optional[str], headers: Optional[Dict[str, str]] = None) -> Response:
+    """JSON response with a content ETag; 304 without a body when the client already has it"""
+    etag = etag_for(body)
+    headers = dict(headers or {}, ETag=etag)
+    headers["Cache-Control"] = "private, no-cache"
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+async def persist_messages(docs: List[dict], retry: bool = False) -> int:
+    """Insert new messages and fold them into the session summaries and insights; returns how many were new.
+
+    A retried write-behind batch (retry=True) is summarized again as a
+    whole, even the messages its first attempt inserted: the summary and
+    rollup updates are keyed by batch, so the ones that already landed are
+    skipped rather than counted twice.
+    """
+    inserted = await insert_new(collection, docs)
+    await summarize_messages(docs if retry else inserted)
+    return len(inserted)
+
+
+async def import_messages(docs: List[dict]) -> int:
+    """persist_messages() for imported dumps, which can overlap stored messages and earlier failed imports.
+
+    Imported messages are stored with `summarized: false` until their
+    summaries are written, so a re-import summarizes exactly the messages
+    an earlier attempt left unsummarized; stored messages without the flag
+    were summarized long ago.
+    """
+    inserted = await insert_new(collection, [dict(doc, summarized=False) for doc in docs])
+    pending = inserted
+    if len(inserted) < len(docs):
+        pending = await collection.find(
+            {"_id": {"$in": [doc["_id"] for doc in docs]}, "summarized": False}
+        ).sort("created_at", 1).to_list(None)
+    await summarize_messages(pending)
+    if pending:
+        await collection.update_many({"_id": {"$in": [doc["_id"] for doc in pending]}}, {"$unset": {"summarized": ""}})
+    return len(inserted)
+
+
+async def summarize_messages(pending: List[dict]):
+    """Fold stored messages into the session summaries and insights rollups, once per batch key"""
+    if not pending:
+        return
+
+    # Keep the per-session summary in step so /sessions never has to scan chat_history
+    summaries = {}
+    for doc in pending:
+        key = (doc["username"], doc["session_id"])
+        if key not in summaries:
+            summaries[key] = {"first": doc, "last": doc, "docs": []}
+        summaries[key]["last"] = doc
+        summaries[key]["docs"].append(doc)
+
+    summaries = list(summaries.values())
+    upserted = await bulk_write_once(session_collection, [
+        update_once(
+            {"username": summary["first"]["username"], "session_id": summary["first"]["session_id"]},
+            {
+                "$setOnInsert": {"preview": summary["first"]["message"], "created_at": summary["first"]["created_at"]},
+                "$max": {"updated_at": summary["last"]["created_at"]},
+                "$inc": {"message_count": len(summary["docs"])}
+            },
+            batch_key(summary["docs"])
+        )
+        for summary in summaries
+    ])
 
-def save_message(session_id: str, role: str, message: str, username: str, source_type=None, sources=None):
-    collection.insert_one({
+    if insights is not None:
+        # Upserted operations are the sessions this batch started
+        new_sessions = [summaries[index]["first"] for index in upserted]
+        try:
+            await insights.record(pending, new_sessions)
+        except Exception as e:
+            # The messages are stored; flagged, they are recorded by the next insights sweep
+            print(f"Insights update failed, leaving {len(pending)} messages to the sweep: {e}")
+            await collection.update_many({"_id": {"$in": [doc["_id"] for doc in pending]}},
+                                         {"$set": {"insights_pending": True}})
+
+
+async def save_message(session_id: str, role: str, message: str, username: str, source_type=None, sources=None,
+                       truncated: bool = False):
+    doc = {
+        "_id": ObjectId(),
         "session_id": session_id,
         "role": role,
         "message": message,
@@ -74,17 +215,44 @@ def save_message(session_id: str, role: str, message: str, username: str, source
         "source_type": source_type,
         "sources": sources or [],
         "created_at": datetime.utcnow()
-    })
+    }
+    if truncated:
+        # Partial reply of a stream the client abandoned
+        doc["truncated"] = True
+    if write_queue is not None:
+        write_queue.submit(doc)
+    else:
+        await persist_messages([doc])
+
+# Materialized analytics rollups, updated on every persisted batch (INSIGHTS_ENABLED=1)
+insights = Insights(db["insights_daily"], db["insights_totals"], collection, db["locks"]) if INSIGHTS_ENABLED else None
+
+# Optional write-behind buffer batching message inserts across sessions (WRITE_BEHIND_ENABLED=1)
+write_queue = WriteBehindQueue(persist_messages) if WRITE_BEHIND_ENABLED else None
+
+# Cross-worker invalidation of in-process state (INVALIDATION_BACKEND=mongo for multi-worker/node)
+invalidation_bus = InvalidationBus(db["invalidations"] if INVALIDATION_BACKEND == "mongo" else None)
+if write_queue is not None:
+    # Queued writes of a deleted session must not be flushed by any worker
+    invalidation_bus.subscribe("session_deleted", write_queue.discard)
+
+# === Upstream Gateways ===
+# Adaptive concurrency, retries with backoff, request-budget deadlines and a circuit breaker per provider
+cohere_gateway = UpstreamGateway("cohere", default_timeout=HTTP_READ_TIMEOUT)
+serp_gateway = UpstreamGateway("serpapi", default_timeout=10)
 
 # === Web Search Integration ===
-def serp_search(query: str) -> Dict:
+# Top result pages are fetched and ranked into passages for the prompt (RETRIEVAL_ENABLED=1; snippets only otherwise)
+retriever = Retriever() if RETRIEVAL_ENABLED else None
+
+async def serp_search(query: str) -> Dict:
     params = {
         "q": query,
         "api_key": SERP_API_KEY,
         "engine": "google",
-        "num": 3
+        "num": max(3, RETRIEVAL_TOP_K) if retriever is not None else 3
     }
-    response = requests.get(SERP_API_URL, params=params, timeout=10)
+    response = await serp_gateway.request("GET", SERP_API_URL, params=params)
     response.raise_for_status()
     data = response.json()
 
@@ -92,13 +260,18 @@ def serp_search(query: str) -> Dict:
     if not results:
         return {"summary": "No relevant search results found.", "sources": []}
 
+    links = [item.get("link", "") for item in results]
+    if retriever is not None:
+        # Cached with the result, so the pages are fetched once per normalized query
+        context = await retriever.build_context(query, results)
+        if context:
+            return {"summary": context, "sources": links}
+
     snippets = []
-    links = []
     for item in results:
         title = item.get("title", "")
         snippet = item.get("snippet", "")
         link = item.get("link", "")
-        links.append(link)
         snippets.append(f"{title}: {snippet}\n{link}")
 
     return {
@@ -106,25 +279,31 @@ def serp_search(query: str) -> Dict:
         "sources": links
     }
 
+# Results keyed on the normalized rewritten query; the shared tier lives in a TTL-indexed collection.
+# Cache misses for the same query are coalesced into a single SerpAPI call.
+search_flights = SingleFlight()
+
+async def coalesced_serp_search(query: str) -> Dict:
+    return await search_flights.do(normalize_query(query), lambda: serp_search(query))
+
+search_cache = SearchCache(coalesced_serp_search, shared=db["search_cache"] if SEARCH_CACHE_SHARED else None)
+
+speculative_search = SpeculativeSearch()
+
 # === Web Search Trigger Logic ===
-def needs_web_search(query: str, cutoff_year: int = 2022) -> bool:
-    query_lower = query.lower()
-    recent_keywords = [
-        "today", "yesterday", "breaking", "currently", "latest", "last week", "last month",
-        "this week", "this month", "just happened", "right now", "live",
-        "update", "recent", "ongoing", "news", "recently"
-    ]
-    if any(keyword in query_lower for keyword in recent_keywords):
-        return True
-    years = re.findall(r"\b(20\d{2})\b", query_lower)
-    if any(int(year) > cutoff_year for year in years):
-        return True
-    return False
+# One precompiled pass over greeting, recency, year and explicit-search cues (see intent.py)
+intent_router = default_router()
+
+def needs_web_search(query: str) -> bool:
+    return intent_router.route(query).flow == "web"
 
 # === LLM Call with Streaming ===
-# Replace your ask_cohere function with this fixed version
+# Identical concurrent calls (same prompt, history and mode) share one upstream request
+llm_flights = SingleFlight()
+llm_stream_flights = StreamFlight()
 
-async def ask_cohere(prompt: str, chat_history: List[dict] = None, stream: bool = False) -> AsyncGenerator[str, None]:
+async def ask_cohere(prompt: str, chat_history: List[dict] = None, stream: bool = False) -> AsyncGenerator:
+    """Yields the full reply text once, or StreamEvents when streaming"""
     payload = {
         "message": prompt,
         "model": "command-r-plus",
@@ -135,67 +314,97 @@ async def ask_cohere(prompt: str, chat_history: List[dict] = None, stream: bool
     if chat_history:
         payload["chat_history"] = chat_history
 
+    key = flight_key(payload)
     if not stream:
-        response = requests.post(COHERE_API_URL, json=payload, headers=HEADERS)
-        if response.status_code == 200:
-            yield response.json().get("text", "[No response]")
-        else:
-            print("Cohere Error:", response.status_code, response.text)
-            yield "[LLM error]"
+        yield await llm_flights.do(key, lambda: cohere_complete(payload))
         return
 
-    response = requests.post(COHERE_API_URL, json=payload, headers=HEADERS, stream=True)
-    if response.status_code != 200:
-        print("Cohere Error:", response.status_code, response.text)
-        yield json.dumps({"error": "[LLM streaming error]"})
+    # Closing this generator leaves the flight at once, so an abandoned stream is cancelled upstream
+    async with aclosing(llm_stream_flights.subscribe(key, lambda: cohere_stream(payload))) as events:
+        async for event in events:
+            yield event
+
+LLM_ERROR = "[LLM error]"
+
+async def cohere_complete(payload: dict) -> str:
+    try:
+        response = await cohere_gateway.request("POST", COHERE_API_URL, json=payload, headers=HEADERS)
+    except UpstreamError as e:
+        print("Cohere Error:", e)
+        return LLM_ERROR
+    if response.status_code == 200:
+        return response.json().get("text", "[No response]")
+    print("Cohere Error:", response.status_code, response.text)
+    return LLM_ERROR
+
+async def cohere_stream(payload: dict) -> AsyncGenerator[StreamEvent, None]:
+    # The upstream stream is closed before the finish signal is yielded, so a consumer
+    # that stops on is_finished never keeps the pooled connection checked out
+    try:
+        async with cohere_gateway.stream("POST", COHERE_API_URL, json=payload, headers=HEADERS) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                print("Cohere Error:", response.status_code, body.decode(errors="replace"))
+                error = True
+            else:
+                error = False
+                debug("Starting to process Cohere streaming response")
+
+                # Each line is decoded once into a StreamEvent
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    if DEBUG_ENABLED:
+                        debug("Raw line from Cohere: %s", line)
+                    event = parse_cohere_line(line)
+                    if event is None:
+                        continue
+                    if event.kind == END:
+                        break
+                    yield event
+    except UpstreamError as e:
+        # Breaker open or request budget spent before the stream started
+        print("Cohere Error:", e)
+        error = True
+
+    if error:
+        yield StreamEvent(ERROR, "[LLM streaming error]")
         return
 
-    print("DEBUG: Starting to process Cohere streaming response")
-    
-    # Process streaming response from Cohere
-    for line in response.iter_lines(decode_unicode=True):
-        if line:
-            line = line.strip()
-            print(f"DEBUG: Raw line from Cohere: {line}")
-            
-            try:
-                data = json.loads(line)
-                
-                # Handle different event types from Cohere streaming API
-                if data.get("event_type") == "text-generation":
-                    # This is the actual text content
-                    text = data.get("text", "")
-                    if text:
-                        yield json.dumps({"response": text})
-                        
-                elif data.get("event_type") == "stream-end":
-                    # Stream has ended
-                    yield json.dumps({"is_finished": True})
-                    return
-                    
-                elif data.get("event_type") == "stream-start":
-                    # Stream is starting - ignore this event
-                    continue
-                    
-                # Handle legacy format if needed
-                elif "text" in data and data.get("text"):
-                    yield json.dumps({"response": data.get("text", "")})
-                    
-                elif data.get("is_finished"):
-                    yield json.dumps({"is_finished": True})
-                    return
-                    
-            except json.JSONDecodeError as e:
-                print(f"DEBUG: Failed to parse JSON: {line}, Error: {e}")
-                # Skip malformed lines
-                continue
-                
     # Ensure we always send a finish signal
-    yield json.dumps({"is_finished": True})
+    yield FINISHED
+
+# === Response Cache for the greeting and plain LLM flows ===
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+async def ask_cohere_cached(flow: str, message: str, prompt: str, chat_history: List[dict]) -> AsyncGenerator[StreamEvent, None]:
+    """Streaming ask_cohere that replays a cached answer as the same events on a hit"""
+    if response_cache is None:
+        async with aclosing(ask_cohere(prompt, chat_history=chat_history, stream=True)) as events:
+            async for event in events:
+                yield event
+        return
+
+    cached = response_cache.lookup(flow, message, chat_history)
+    if cached is not None:
+        for piece in replay_chunks(cached):
+            yield StreamEvent(TEXT, piece)
+        yield FINISHED
+        return
+
+    started = time.perf_counter()
+    parts = []
+    async with aclosing(ask_cohere(prompt, chat_history=chat_history, stream=True)) as events:
+        async for event in events:
+            if event.kind == TEXT:
+                parts.append(event.text)
+            elif event.kind == END and parts:
+                # Stored before the finish event is handed on: consumers stop reading at END
+                response_cache.store(flow, message, chat_history, "".join(parts), time.perf_counter() - started)
+            yield event
 
 def is_greeting(message: str) -> bool:
-    greetings = [r"\bhi\b", r"\bhello\b", r"\bhey\b", r"good (morning|afternoon|evening|night)", r"how are you\??", r"what'?s up\??", r"how'?s it going\??"]
-    return any(re.search(greet, message.lower()) for greet in greetings)
+    return intent_router.route(message).flow == "greeting"
 
 async def rewrite_query_with_llm(message: str, chat_history: List[dict]) -> str:
     prompt = (
@@ -215,111 +424,45 @@ def format_chat_history(chat_history):
         f"{msg['role'].capitalize()}: {msg['message']}" for msg in chat_history
     ])
 
-# === Main Chat Endpoint with Streaming ===
-# Replace your chat endpoint function with this improved version
-
-async def chat(request: ChatRequest):
-    message = request.message.strip()
-    chat_history = get_chat_history(request.session_id, request.username)
-
-    # Save user message to DB
-    save_message(request.session_id, "user", message, request.username)
-
-    async def stream_response() -> AsyncGenerator[str, None]:
-        nonlocal chat_history
-        full_response = ""
-        source_type = "llm"
-        sources = []
+# === Prompts ===
+# Shared by the streaming /chat flows and batch jobs
+def build_greeting_prompt(message: str) -> str:
+    return (
+        f"The user greeted you with: \"{message}\"\n\n"
+        "Respond warmly and naturally as a helpful assistant. But do not mention your name, that you are an AI assistant, or describe what you are. "
+        "Include a friendly tone, maybe an emoji if appropriate, and invite them to ask their question."
+    )
 
-        try:
-            # 🟢 Greeting flow
-            if is_greeting(message):
-                greeting_prompt = (
-                    f"The user greeted you with: \"{message}\"\n\n"
-                    "Respond warmly and naturally as a helpful assistant. But do not mention your name, that you are an AI assistant, or describe what you are. "
-                    "Include a friendly tone, maybe an emoji if appropriate, and invite them to ask their question."
-                )
-                print(f"\n🟢 Greeting flow: {greeting_prompt}\n")
-                
-                async for chunk in ask_cohere(greeting_prompt, chat_history=chat_history, stream=True):
-                    try:
-                        chunk_data = json.loads(chunk)
-                        if "response" in chunk_data and chunk_data["response"]:
-                            full_response += chunk_data["response"]
-                            sse_chunk = f"data: {chunk}\n\n"
-                            print(f"DEBUG: Sending SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                        elif chunk_data.get("is_finished"):
-                            sse_chunk = f"data: {json.dumps({'is_finished': True, 'source_type': source_type, 'sources': sources})}\n\n"
-                            print(f"DEBUG: Sending final SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                            break
-                    except json.JSONDecodeError as e:
-                        print(f"DEBUG: JSON parsing error in greeting flow: {e}")
-                        continue
-                        
-                # Save to database
-                save_message(request.session_id, "assistant", full_response, request.username, source_type=source_type, sources=sources)
-                return
+def build_web_prompt(message: str, search_summary: str, formatted_history: str) -> str:
+    return (
+        "# Role\n"
+        "You are a well-informed and helpful assistant continuing an ongoing conversation with a user.\n\n"
+        "# Context\n"
+        "Here is helpful information from a recent web search:\n"
+        f"{search_summary}\n\n"
+        "# Chat History\n"
+        f"{formatted_history}\n\n"
+        "# User Query\n"
+        f"The user now asks:\n\"{message}\"\n\n"
+        "# Guidelines\n"
+        "- Respond accurately and thoroughly using the provided context and prior messages.\n"
+        "- Tailor your depth to the nature of the question (short if simple, detailed if complex).\n"
+        "- If the topic is broad, organize your response into clear, relevant sections (e.g., `Politics`, `Military`, `Economy`, `Society`, etc.).\n"
+        "# Important\n"
+        "- If the question is ambiguous, briefly address multiple interpretations.\n"
+        "- Only include a **`Summary`** section at the end **if it adds value** beyond the main content.\n"
+        "- Always end with a warm, supportive closing that invites follow-up questions.\n"
+        "# Style Tips\n"
+        "- Use a natural, conversational tone—avoid sounding robotic or overly formal.\n"
+        "- Use **emojis in bullet points** when they help make information more clear and visually accessible.\n"
+        "- Keep your language clear and reader-friendly.\n"
+    )
 
-            # 🟡 Web search flow
-            elif needs_web_search(message):
-                resolved_query = await rewrite_query_with_llm(message, chat_history)
-                print(f"\nRewritten query for web search: {resolved_query}\n")
-                web_data = serp_search(resolved_query)
-                formatted_history = format_chat_history(chat_history)
-
-                combined_prompt = (
-                    "# Role\n"
-                    "You are a well-informed and helpful assistant continuing an ongoing conversation with a user.\n\n"
-                    "# Context\n"
-                    "Here is helpful information from a recent web search:\n"
-                    f"{web_data['summary']}\n\n"
-                    "# Chat History\n"
-                    f"{formatted_history}\n\n"
-                    "# User Query\n"
-                    f"The user now asks:\n\"{message}\"\n\n"
-                    "# Guidelines\n"
-                    "- Respond accurately and thoroughly using the provided context and prior messages.\n"
-                    "- Tailor your depth to the nature of the question (short if simple, detailed if complex).\n"
-                    "- If the topic is broad, organize your response into clear, relevant sections (e.g., `Politics`, `Military`, `Economy`, `Society`, etc.).\n"
-                    "# Important\n"
-                    "- If the question is ambiguous, briefly address multiple interpretations.\n"
-                    "- Only include a **`Summary`** section at the end **if it adds value** beyond the main content.\n"
-                    "- Always end with a warm, supportive closing that invites follow-up questions.\n"
-                    "# Style Tips\n"
-                    "- Use a natural, conversational tone—avoid sounding robotic or overly formal.\n"
-                    "- Use **emojis in bullet points** when they help make information more clear and visually accessible.\n"
-                    "- Keep your language clear and reader-friendly.\n"
-                )
-
-                print(f"\n🟡 Web search flow: {combined_prompt}\n")
-                source_type = "web"
-                sources = web_data.get("sources", [])
-                
-                async for chunk in ask_cohere(combined_prompt, chat_history=chat_history, stream=True):
-                    try:
-                        chunk_data = json.loads(chunk)
-                        if "response" in chunk_data and chunk_data["response"]:
-                            full_response += chunk_data["response"]
-                            sse_chunk = f"data: {chunk}\n\n"
-                            print(f"DEBUG: Sending SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                        elif chunk_data.get("is_finished"):
-                            sse_chunk = f"data: {json.dumps({'is_finished': True, 'source_type': source_type, 'sources': sources})}\n\n"
-                            print(f"DEBUG: Sending final SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                            break
-                    except json.JSONDecodeError as e:
-                        print(f"DEBUG: JSON parsing error in web search flow: {e}")
-                        continue
-                        
-            else:
-                # 🔵 Normal LLM response flow
-                base_prompt = (
-                    f"You are a well-informed and helpful assistant. A user has asked the following:\n"
-                    f"\"{message}\"\n\n"
-                    '''
+def build_llm_prompt(message: str) -> str:
+    return (
+        f"You are a well-informed and helpful assistant. A user has asked the following:\n"
+        f"\"{message}\"\n\n"
+        '''
                     # Guidelines
                     1. Respond with thoroughness, clarity, and helpfulness, adapting to the complexity of the user's query. Respond directly without thanks or commentary about the prompt itself.
                     2. For broad or complex topics, organize the response into clearly labeled sections (e.g., Politics, Military, Economy, Diplomacy, Society, etc.).
@@ -340,39 +483,195 @@ async def chat(request: ChatRequest):
                     3. Avoid robotic or overly formal tone—keep it friendly, human-like, and informed.
                     4. Maintain flexibility—don't force summaries or sections if they don't serve the user's intent.
                     '''
-                )
-                print(f"\n🔵 Normal LLM response flow: {base_prompt}\n")
-                
-                async for chunk in ask_cohere(base_prompt, chat_history=chat_history, stream=True):
-                    try:
-                        chunk_data = json.loads(chunk)
-                        if "response" in chunk_data and chunk_data["response"]:
-                            full_response += chunk_data["response"]
-                            sse_chunk = f"data: {chunk}\n\n"
-                            print(f"DEBUG: Sending SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                        elif chunk_data.get("is_finished"):
-                            sse_chunk = f"data: {json.dumps({'is_finished': True, 'source_type': source_type, 'sources': sources})}\n\n"
-                            print(f"DEBUG: Sending final SSE chunk: {sse_chunk.strip()}")
-                            yield sse_chunk
-                            break
-                    except json.JSONDecodeError as e:
-                        print(f"DEBUG: JSON parsing error in normal flow: {e}")
-                        continue
+    )
+
+# === Bounded Chat History ===
+async def summarize_text(prompt: str) -> str:
+    async for response in ask_cohere(prompt, stream=False):
+        return response
+
+history_window = HistoryWindow(
+    collection, session_collection, summarize_text,
+    pending=write_queue.pending_for if write_queue is not None else None
+)
+
+# === Main Chat Endpoint with Streaming ===
+# Replace your chat endpoint function with this improved version
+
+# Persistence of abandoned streams outlives the request task that was cancelled
+background_tasks = set()
+
+# Generations run detached from the response so a reconnecting EventSource can resume them
+resumable_streams = ResumableStreams() if RESUMABLE_STREAMS_ENABLED else None
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def chat(request: ChatRequest, flush_policy: Optional[FlushPolicy] = None, http_request: Optional[Request] = None):
+    message = request.message.strip()
+    trace = RequestTrace()
+    # A resumable generation has no client of its own; its followers watch for disconnects instead
+    disconnect_watch = DisconnectWatch(http_request if resumable_streams is None else None)
+    # Every upstream call made for this request gets at most what is left of REQUEST_BUDGET_SECONDS
+    deadline = start_request_budget()
+    # Rolling summary + recent turns within HISTORY_TOKEN_BUDGET instead of the full transcript
+    with trace.stage("history"):
+        chat_history, history_boundary = await history_window.load(request.session_id, request.username)
+    history_window.schedule_compaction(request.session_id, request.username, history_boundary)
+
+    # Save user message to DB; the write overlaps with routing, rewrite, search and generation
+    # and is awaited before the assistant reply is persisted
+    user_saved = asyncio.create_task(save_message(request.session_id, "user", message, request.username))
+
+    async def stream_response() -> AsyncGenerator[bytes, None]:
+        nonlocal chat_history
+        # Reply text is collected as parts and joined once when the stream is done
+        parts = []
+        source_type = "llm"
+        sources = []
+        outcome = "ok"
+        persisted = False
+
+        async def persist_reply(truncated: bool = False):
+            nonlocal persisted
+            persisted = True
+            await user_saved
+            if parts:  # Only save if we got a response
+                await save_message(request.session_id, "assistant", "".join(parts), request.username,
+                                   source_type=source_type, sources=sources, truncated=truncated)
+
+        async def collect(events: AsyncGenerator[StreamEvent, None]) -> AsyncGenerator[StreamEvent, None]:
+            # Tokens are recorded as they arrive, before any coalescing of the frames
+            async for event in events:
+                if event.kind == TEXT:
+                    parts.append(event.text)
+                    trace.token()
+                yield event
+
+        async def relay(events: AsyncGenerator[StreamEvent, None]) -> AsyncGenerator[bytes, None]:
+            chain = [events, collect(events)]
+            if flush_policy is not None:
+                chain.append(coalesce_events(chain[-1], flush_policy))
+            try:
+                async for event in chain[-1]:
+                    if event.kind == TEXT:
+                        await disconnect_watch.check()
+                        yield text_frame(event.text)
+                    elif event.kind == END:
+                        final_frame = frame({"is_finished": True, "source_type": source_type, "sources": sources})
+                        debug("Sending final SSE chunk: %s", final_frame)
+                        yield final_frame
+                        break
+                    elif event.kind == ERROR:
+                        yield frame({"error": event.text, "is_finished": True})
+                        break
+            finally:
+                # Outermost first, down to the LLM stream: cancels the upstream request and frees its slot
+                for gen in reversed(chain):
+                    await gen.aclose()
+
+        # The body is iterated after chat() returns; carry the deadline over explicitly
+        request_deadline.set(deadline)
+
+        try:
+            with trace.stage("route"):
+                route = intent_router.route(message)
+            debug("Routed to %s (score %s, cues %s)", route.flow, route.score, route.cues, sample=1)
+            greeting = route.flow == "greeting"
+            web_search = route.flow == "web"
+
+            if web_search:
+                # Rewrite and a speculative search on the raw message run concurrently
+                try:
+                    resolved_query, web_data, reused = await speculative_search.run(
+                        message,
+                        lambda: trace.timed("rewrite", rewrite_query_with_llm(message, chat_history)),
+                        lambda query: trace.timed("search", search_cache.get_or_search(query))
+                    )
+                except (UpstreamError, httpx.HTTPError) as e:
+                    # SerpAPI down, throttling us or its breaker open: answer from the model alone
+                    print(f"Web search unavailable, falling back to the LLM-only flow: {e}")
+                    web_search = False
+                else:
+                    if reused:
+                        search_cache.put(resolved_query, web_data)
+                    debug("Rewritten query for web search: %s (speculative result reused: %s)", resolved_query, reused, sample=1)
+
+            # Nobody is waiting for an answer any more: skip the generation altogether
+            await disconnect_watch.check()
+
+            # 🟢 Greeting flow
+            if greeting:
+                trace.flow = "greeting"
+                greeting_prompt = build_greeting_prompt(message)
+                debug("Greeting flow: %s", greeting_prompt, sample=1)
+
+                trace.start_generation()
+                async for sse_frame in relay(ask_cohere_cached("greeting", message, greeting_prompt, chat_history)):
+                    yield sse_frame
+                        
+                # Save to database
+                with trace.stage("persist"):
+                    await persist_reply()
+                return
+
+            # 🟡 Web search flow
+            elif web_search:
+                trace.flow = "web"
+                combined_prompt = build_web_prompt(message, web_data["summary"], format_chat_history(chat_history))
+
+                debug("Web search flow: %s", combined_prompt, sample=1)
+                source_type = "web"
+                sources = web_data.get("sources", [])
+
+                trace.start_generation()
+                async for sse_frame in relay(ask_cohere(combined_prompt, chat_history=chat_history, stream=True)):
+                    yield sse_frame
+                        
+            else:
+                # 🔵 Normal LLM response flow
+                trace.flow = "llm"
+                base_prompt = build_llm_prompt(message)
+                debug("Normal LLM response flow: %s", base_prompt, sample=1)
+
+                trace.start_generation()
+                async for sse_frame in relay(ask_cohere_cached("llm", message, base_prompt, chat_history)):
+                    yield sse_frame
 
             # Save assistant response to DB after streaming is complete
-            if full_response:  # Only save if we got a response
-                save_message(request.session_id, "assistant", full_response, request.username, source_type=source_type, sources=sources)
-                
+            with trace.stage("persist"):
+                await persist_reply()
+
+        except ClientDisconnected:
+            outcome = "cancelled"
+            debug("Client disconnected after %d tokens, upstream stream cancelled", len(parts), sample=1)
+            run_in_background(persist_reply(truncated=True))
+        except (asyncio.CancelledError, GeneratorExit):
+            # The server tore the response down (client gone); keep what was generated so far
+            outcome = "cancelled"
+            if not persisted:
+                run_in_background(persist_reply(truncated=True))
+            raise
         except Exception as e:
+            outcome = "error"
             print(f"ERROR in stream_response: {e}")
             # Send error message to frontend
-            error_chunk = f"data: {json.dumps({'error': 'An error occurred while processing your request', 'is_finished': True})}\n\n"
-            yield error_chunk
+            yield frame({"error": "An error occurred while processing your request", "is_finished": True})
+        finally:
+            trace.finish(outcome)
+
+    if resumable_streams is None:
+        return sse_response(stream_response())
+    generation = resumable_streams.start(stream_response(), owner=(request.username, request.session_id))
+    return sse_response(generation.follow(0, DisconnectWatch(http_request)))
 
-    # Return StreamingResponse with proper SSE headers
+
+def sse_response(body: AsyncGenerator[bytes, None]) -> StreamingResponse:
+    """StreamingResponse with proper SSE headers"""
     return StreamingResponse(
-        stream_response(), 
+        body,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -386,45 +685,318 @@ async def chat(request: ChatRequest):
 
 @app.get("/chat")
 async def chat_get(
+    http_request: Request,
     session_id: str = Query(...),
     message: str = Query(...),
-    username: str = Query(...)
+    username: str = Query(...),
+    coalesce: bool = Query(False, description="Merge tokens into fewer SSE frames"),
+    flush_ms: Optional[int] = Query(None, ge=0, le=1000, description="Flush coalesced text at least this often"),
+    flush_bytes: Optional[int] = Query(None, ge=0, le=65536, description="Flush once this much text is buffered"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID")
 ):
+    if resumable_streams is not None and last_event_id:
+        # EventSource reconnect: continue the reply it was reading, never start a second generation
+        resumed = resumable_streams.resume(last_event_id, (username, session_id), DisconnectWatch(http_request))
+        if resumed is not None:
+            return sse_response(resumed)
+
     request = ChatRequest(session_id=session_id, message=message, username=username)
-    return await chat(request)
+    # Per-token frames unless the client opts in; the first token is never delayed
+    flush_policy = None
+    if coalesce or flush_ms is not None or flush_bytes is not None:
+        defaults = FlushPolicy()
+        flush_policy = FlushPolicy(
+            defaults.flush_ms if flush_ms is None else flush_ms,
+            defaults.flush_bytes if flush_bytes is None else flush_bytes
+        )
+        if flush_policy.flush_ms == 0 and flush_policy.flush_bytes == 0:
+            # With neither trigger the whole reply would be held back until the stream ends
+            raise HTTPException(status_code=400, detail="flush_ms and flush_bytes cannot both be 0")
+    return await chat(request, flush_policy, http_request)
 
 # === Session History Endpoints ===
-@app.get("/sessions")
-def get_sessions(username: str):
-    pipeline = [
-        {"$match": {"username": username}},
-        {"$sort": {"created_at": 1}},
-        {"$group": {
-            "_id": "$session_id",
-            "first_message": {"$first": "$message"},
-            "created_at": {"$first": "$created_at"}
-        }},
-        {"$sort": {"created_at": -1}}
+async def queued_sessions(username: str) -> List[dict]:
+    """Sessions whose first message is still in the write-behind queue, oldest first"""
+    pending = write_queue.pending_sessions(username)
+    if not pending:
+        return []
+    # Stored sessions with more queued messages already have their place in the list
+    stored = await session_collection.find(
+        {"username": username, "session_id": {"$in": list(pending)}}, {"_id": 0, "session_id": 1}
+    ).to_list(None)
+    stored = {s["session_id"] for s in stored}
+    fresh = [
+        {"_id": doc["_id"], "session_id": session_id, "preview": doc["message"], "created_at": doc["created_at"]}
+        for session_id, doc in pending.items() if session_id not in stored
     ]
-    sessions = list(collection.aggregate(pipeline))
-    return [{"session_id": s["_id"], "preview": s["first_message"]} for s in sessions]
+    return sorted(fresh, key=lambda s: s["created_at"])
+
+
+@app.get("/sessions")
+async def get_sessions(
+    username: str,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    before: Optional[str] = Query(None, description="X-Before-Cursor of a page: older sessions"),
+    after: Optional[str] = Query(None, description="X-After-Cursor of a page: newer sessions"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    # Served by the (username, created_at) index on the sessions summary collection
+    headers = {}
+    if limit is None and before is None and after is None:
+        sessions = await session_collection.find(
+            {"username": username},
+            {"_id": 0, "session_id": 1, "preview": 1}
+        ).sort("created_at", -1).to_list(None)
+        if write_queue is not None:
+            sessions = (await queued_sessions(username))[::-1] + sessions
+    else:
+        limit = limit or PAGE_DEFAULT_LIMIT
+        try:
+            page = await fetch_page(
+                session_collection, {"username": username},
+                {"_id": 1, "session_id": 1, "preview": 1, "created_at": 1},
+                limit, before, after
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if write_queue is not None and before is None and after is None:
+            # Brand-new sessions go on the newest page, which still holds at most `limit` sessions
+            merged = sorted(page.docs + await queued_sessions(username), key=lambda s: s["created_at"])
+            page = overlay_newest(page, merged, limit)
+        sessions = page.docs[::-1]  # newest first, like the unpaged list
+        headers = page_headers(page)
+    result = [{"session_id": s["session_id"], "preview": s["preview"]} for s in sessions]
+    return json_with_etag(result, if_none_match, headers)
+
+history_search = HistorySearch(collection)
+
+@app.get("/search")
+async def search_history(
+    username: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET)
+):
+    """Ranked full-text search over all of a user's messages, with highlighted snippets"""
+    try:
+        return await history_search.search(username, q, limit, offset)
+    except NotImplementedError:
+        # mongomock (MONGO_BACKEND=memory) has no text search
+        raise HTTPException(status_code=501, detail="Full-text search needs a MongoDB server")
+    except OperationFailure as e:
+        raise HTTPException(status_code=400, detail=f"Search failed: {e}")
+
+def require_insights() -> Insights:
+    if insights is None:
+        raise HTTPException(status_code=404, detail="Insights are disabled")
+    return insights
+
+@app.get("/insights")
+async def insights_summary(username: Optional[str] = None):
+    """Totals, flow split, top cited domains and averages for one user, or for everyone"""
+    return await require_insights().summary(username)
+
+@app.get("/insights/daily")
+async def insights_daily(username: Optional[str] = None, days: int = Query(30, ge=1, le=INSIGHTS_MAX_DAYS)):
+    """The same figures per UTC day, oldest first; days without messages are omitted"""
+    return await require_insights().daily_series(username, days)
+
+@app.post("/insights/rebuild", status_code=202)
+async def insights_rebuild(username: Optional[str] = None):
+    """Recompute the rollups of closed days from chat_history in the background"""
+    started = require_insights().schedule_rebuild(username)
+    return {"status": "started" if started else "already running"}
+
+@app.get("/export")
+async def export_history(username: Optional[str] = None, compress: bool = True):
+    """Stream a user's (or every) chat_history as NDJSON, gzip-compressed unless compress=false"""
+    report = TransferReport()
+    chunks = export_lines(collection, export_query(username), report)
+    if compress:
+        chunks = gzip_chunks(chunks, report)
+
+    async def body():
+        try:
+            async for chunk in chunks:
+                if not compress:
+                    report.bytes += len(chunk)
+                yield chunk
+        finally:
+            print(f"Export of {username or 'all users'}: {report.finish().as_dict()}")
+
+    filename = f"chat_history-{username or 'all'}-{datetime.utcnow():%Y%m%d}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/import")
+async def import_history(http_request: Request, username: Optional[str] = None):
+    """Load an /export dump (plain or gzip NDJSON body); messages whose _id exists are skipped"""
+    report = TransferReport()
+    try:
+        await import_lines(ndjson_lines(http_request.stream()), import_messages, report, username)
+    except ValueError as e:
+        # Batches before the bad line are already stored; re-sending the whole dump is safe
+        raise HTTPException(status_code=400, detail=f"{e} (after {report.docs} lines, {report.inserted} inserted)")
+    result = report.as_dict()
+    print(f"Import for {username or 'all users'}: {result}")
+    return result
+
+# === Batch Question Answering ===
+class BatchRequest(BaseModel):
+    messages: List[str]
+
+async def answer_batch_item(message: str, limits: ProviderLimits) -> dict:
+    """One standalone question through the /chat routing, web search and LLM, without streaming or history"""
+    start_request_budget()
+    message = message.strip()
+    flow = intent_router.route(message).flow
+    sources = []
+    if flow == "greeting":
+        prompt = build_greeting_prompt(message)
+    elif flow == "web":
+        try:
+            async with limits.slot("serpapi"):
+                web_data = await search_cache.get_or_search(message)
+        except (UpstreamError, httpx.HTTPError) as e:
+            print(f"Web search unavailable for a batch item, answering from the LLM alone: {e}")
+            flow = "llm"
+        else:
+            prompt = build_web_prompt(message, web_data["summary"], "")
+            sources = web_data.get("sources", [])
+    if flow == "llm":
+        prompt = build_llm_prompt(message)
+
+    async with limits.slot("cohere"):
+        async for reply in ask_cohere(prompt, stream=False):
+            break
+    if reply == LLM_ERROR:
+        raise UpstreamError("cohere", "no answer from the LLM")
+    return {"flow": flow, "reply": reply, "sources": sources}
+
+# Job state lives in Mongo, so any worker can answer for a job; the accepting worker runs it
+batch_runner = BatchRunner(answer_batch_item, BatchStore(db["batch_jobs"], db["batch_results"]))
+
+async def require_batch(job_id: str) -> dict:
+    job = await batch_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found or expired")
+    return job
+
+@app.post("/batch", status_code=202)
+async def create_batch(request: BatchRequest):
+    """Answer many messages in the background; poll /batch/{job_id} or follow /batch/{job_id}/stream"""
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages")
+    if len(request.messages) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} messages per batch")
+    try:
+        job = await batch_runner.submit(request.messages)
+    except BatchFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return dict(summary_of(job), status_url=f"/batch/{job['_id']}", stream_url=f"/batch/{job['_id']}/stream")
+
+@app.get("/batch/{job_id}")
+async def get_batch(job_id: str, results: bool = True):
+    snapshot = await batch_runner.snapshot(job_id, include_results=results)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Batch job not found or expired")
+    return snapshot
+
+@app.get("/batch/{job_id}/stream")
+async def stream_batch(job_id: str):
+    """NDJSON: one line per result as it completes, then a summary line"""
+    await require_batch(job_id)
+
+    async def lines():
+        async for item in batch_runner.follow(job_id):
+            yield dumps(item) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.delete("/batch/{job_id}")
+async def cancel_batch(job_id: str):
+    await require_batch(job_id)
+    job = await batch_runner.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found or expired")
+    return summary_of(job)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the /chat latency histograms"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "search": search_cache.stats(),
+        "batch": batch_runner.stats(),
+        "history": history_window.stats(),
+        "insights": insights.stats() if insights is not None else {"enabled": False},
+        "retrieval": retriever.stats() if retriever is not None else {"enabled": False},
+        "response": response_cache.stats() if response_cache is not None else {"enabled": False},
+        "speculative_search": speculative_search.stats(),
+        "invalidation": invalidation_bus.stats(),
+        "resumable_streams": resumable_streams.stats() if resumable_streams is not None else {"enabled": False},
+        "upstream": {"cohere": cohere_gateway.stats(), "serpapi": serp_gateway.stats()},
+        "auth": dict(password_hasher.stats(), **session_tokens.stats()),
+        "coalescing": {
+            "search": search_flights.stats(),
+            "llm": llm_flights.stats(),
+            "llm_stream": llm_stream_flights.stats()
+        }
+    }
 
 @app.get("/chat/{session_id}")
-def get_session_messages(session_id: str, username: str):
-    return get_chat_history(session_id, username)
+async def get_session_messages(
+    session_id: str,
+    username: str,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    before: Optional[str] = Query(None, description="X-Before-Cursor of a page: older messages"),
+    after: Optional[str] = Query(None, description="X-After-Cursor of a page: newer messages"),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    if limit is None and before is None and after is None:
+        return json_with_etag(await get_chat_history(session_id, username), if_none_match)
+
+    # Without a cursor this is the newest page, in chronological order
+    limit = limit or PAGE_DEFAULT_LIMIT
+    try:
+        page = await fetch_page(
+            collection, {"session_id": session_id, "username": username},
+            {"_id": 1, "role": 1, "message": 1, "created_at": 1},
+            limit, before, after
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    docs = page.docs
+    if write_queue is not None and before is None and after is None:
+        page = overlay_newest(page, merge_pending(docs, write_queue.pending_for(username, session_id)), limit)
+        docs = page.docs
+    return json_with_etag([to_api_message(doc) for doc in docs], if_none_match, page_headers(page))
 
 # Add this endpoint to your existing FastAPI backend (after your other endpoints)
 
 @app.delete("/sessions/{session_id}")
-def delete_session(session_id: str, username: str = Query(...)):
+async def delete_session(session_id: str, username: str = Query(...)):
     """Delete a chat session and all its messages"""
     try:
+        await invalidation_bus.publish("session_deleted", username=username, session_id=session_id)
+
         # Delete all messages for this session from MongoDB
-        result = collection.delete_many({
+        result = await collection.delete_many({
             "session_id": session_id, 
             "username": username
         })
         
+        await session_collection.delete_one({
+            "session_id": session_id,
+            "username": username
+        })
+
         # Check if any documents were deleted
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Session not found or no messages to delete")
@@ -467,23 +1039,21 @@ class RenameSessionRequest(BaseModel):
     new_name: str
 
 @app.put("/sessions/{session_id}/rename")
-def rename_session(session_id: str, request: RenameSessionRequest, username: str = Query(...)):
-    """Rename a chat session by updating the first user message"""
+async def rename_session(session_id: str, request: RenameSessionRequest, username: str = Query(...)):
+    """Rename a chat session by updating its preview in the sessions collection"""
     try:
         new_name = request.new_name.strip()
         if not new_name:
             raise HTTPException(status_code=400, detail="New name cannot be empty")
         
-        # Find the first user message in this session and update it
-        # This will change what appears in the session preview
-        result = collection.update_one(
+        # The preview lives on the session summary, so the original message stays untouched
+        result = await session_collection.update_one(
             {
                 "session_id": session_id, 
-                "username": username, 
-                "role": "user"
+                "username": username
             },
             {
-                "$set": {"message": new_name}
+                "$set": {"preview": new_name, "updated_at": datetime.utcnow()}
             }
         )
         
@@ -502,28 +1072,48 @@ def rename_session(session_id: str, request: RenameSessionRequest, username: str
         raise HTTPException(status_code=500, detail=f"Failed to rename session: {str(e)}")
 
 # === Auth Endpoints ===
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_user(username: str):
-    return user_collection.find_one({"username": username})
+# bcrypt runs on a small bounded pool; when it is saturated requests get 429 instead of queueing
+password_hasher = PasswordHasher()
+session_tokens = SessionTokens(db["auth_tokens"])
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def auth_busy() -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail="Too many authentication requests in progress, please retry shortly",
+        headers={"Retry-After": str(AUTH_RETRY_AFTER_SECONDS)}
+    )
 
-def hash_password(password):
-    return pwd_context.hash(password)
+async def get_user(username: str):
+    return await user_collection.find_one({"username": username})
 
 @app.post("/signup")
-def signup(credentials: UserCredentials):
-    if get_user(credentials.username):
+async def signup(credentials: UserCredentials):
+    if await get_user(credentials.username):
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_pwd = hash_password(credentials.password)
-    user_collection.insert_one({"username": credentials.username, "password": hashed_pwd})
+    try:
+        hashed_pwd = await password_hasher.hash(credentials.password)
+    except PoolSaturated:
+        raise auth_busy()
+    await user_collection.insert_one({"username": credentials.username, "password": hashed_pwd})
     return {"message": "Signup successful"}
 
 @app.post("/login")
-def login(credentials: UserCredentials):
-    user = get_user(credentials.username)
-    if not user or not verify_password(credentials.password, user["password"]):
+async def login(credentials: UserCredentials, authorization: Optional[str] = Header(None)):
+    user = await get_user(credentials.username)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"message": "Login successful"}
+    if not session_tokens.was_verified(credentials.username, credentials.password, user["password"]):
+        try:
+            verified = await password_hasher.verify(credentials.password, user["password"])
+        except PoolSaturated:
+            raise auth_busy()
+        if not verified:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        session_tokens.remember_verified(credentials.username, credentials.password, user["password"])
+    # The password is always checked; a live token of the same user is handed back instead of a new one
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):]
+        if await session_tokens.username_for(token) == credentials.username:
+            return {"message": "Login successful", "token": token}
+    token = await session_tokens.issue(credentials.username)
+    return {"message": "Login successful", "token": token}
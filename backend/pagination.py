@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# === Pagination Settings ===
+# Used when a cursor is given without a limit
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "50"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "200"))
+
+# Keyset order of every paginated collection: created_at, then _id as the tie-breaker
+KEYSET_ASCENDING = [("created_at", 1), ("_id", 1)]
+KEYSET_DESCENDING = [("created_at", -1), ("_id", -1)]
+
+
+class Page(NamedTuple):
+    docs: List[dict]           # oldest first
+    before: Optional[str]      # cursor for the next older page, None when there is none
+    after: Optional[str]       # cursor for newer items; kept even on an empty page so clients can poll
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"].isoformat(), str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Raises ValueError for anything that is not a cursor issued by encode_cursor"""
+    try:
+        created_at, object_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), ObjectId(object_id)
+    except (TypeError, ValueError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_filter(cursor: str, direction: str) -> dict:
+    """Documents strictly before ("$lt") or after ("$gt") the cursor in keyset order"""
+    created_at, object_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {direction: created_at}},
+        {"created_at": created_at, "_id": {direction: object_id}},
+    ]}
+
+
+async def fetch_page(collection, query: dict, projection: dict, limit: int,
+                     before: Optional[str] = None, after: Optional[str] = None) -> Page:
+    """One keyset page of `query`: the newest `limit` documents, or those next to a cursor.
+
+    Reads limit + 1 documents along the index to learn whether more exist,
+    so no count or skip is ever needed.
+    """
+    if after is not None:
+        docs = await collection.find(
+            {"$and": [query, keyset_filter(after, "$gt")]}, projection
+        ).sort(KEYSET_ASCENDING).limit(limit + 1).to_list(None)
+        docs = docs[:limit]
+        return Page(docs, encode_cursor(docs[0]) if docs else after, encode_cursor(docs[-1]) if docs else after)
+
+    if before is not None:
+        query = {"$and": [query, keyset_filter(before, "$lt")]}
+    docs = await collection.find(query, projection).sort(KEYSET_DESCENDING).limit(limit + 1).to_list(None)
+    has_older = len(docs) > limit
+    docs = docs[:limit][::-1]
+    return Page(
+        docs,
+        encode_cursor(docs[0]) if docs and has_older else None,
+        encode_cursor(docs[-1]) if docs else before,
+    )
+
+
+def overlay_newest(page: Page, merged: List[dict], limit: int) -> Page:
+    """The newest page after unflushed rows were merged into its docs (oldest first).
+
+    Only the newest `limit` rows are returned, and the cursors are taken from
+    those rows, so stored rows pushed off the page by queued ones are on the
+    next older page instead of being skipped.
+    """
+    docs = merged[-limit:]
+    has_older = page.before is not None or len(merged) > len(docs)
+    return Page(
+        docs,
+        encode_cursor(docs[0]) if docs and has_older else None,
+        encode_cursor(docs[-1]) if docs else page.after,
+    )
+
+
+def page_headers(page: Page) -> Dict[str, str]:
+    headers = {}
+    if page.before:
+        headers["X-Before-Cursor"] = page.before
+    if page.after:
+        headers["X-After-Cursor"] = page.after
+    return headers
+
+
+def etag_for(body) -> str:
+    digest = hashlib.sha1(json.dumps(body, separators=(",", ":"), default=str).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
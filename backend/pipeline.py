@@ -0,0 +1,62 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Tuple
+
+from search_cache import normalize_query
+
+# === Speculative Search Settings ===
+SPECULATIVE_SEARCH_ENABLED = os.getenv("SPECULATIVE_SEARCH_ENABLED", "1") == "1"
+# Token overlap between the raw message and the rewritten query needed to reuse the speculative result
+SPECULATIVE_REUSE_SIMILARITY = float(os.getenv("SPECULATIVE_REUSE_SIMILARITY", "0.6"))
+
+
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard overlap of the normalized word sets"""
+    left, right = set(normalize_query(a).split()), set(normalize_query(b).split())
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class SpeculativeSearch:
+    """Runs the query rewrite and a search on the raw message concurrently.
+
+    If the rewritten query is close enough to the raw message the speculative
+    result is used as is; otherwise it is cancelled and the rewritten query is
+    searched. Either way the rewrite latency and the search latency overlap
+    for the common case of already-specific questions.
+    """
+
+    def __init__(self, enabled: bool = SPECULATIVE_SEARCH_ENABLED, threshold: float = SPECULATIVE_REUSE_SIMILARITY):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.reused = 0
+        self.discarded = 0
+
+    async def run(self, message: str, rewrite: Callable[[], Awaitable[str]],
+                  search: Callable[[str], Awaitable[Dict]]) -> Tuple[str, Dict, bool]:
+        """Return (rewritten query, search result, whether the speculative result was reused)"""
+        speculative = asyncio.create_task(search(message)) if self.enabled else None
+        try:
+            resolved_query = await rewrite()
+        except BaseException:
+            if speculative is not None:
+                speculative.cancel()
+            raise
+
+        if speculative is not None:
+            if query_similarity(message, resolved_query) >= self.threshold:
+                try:
+                    result = await speculative
+                    self.reused += 1
+                    return resolved_query, result, True
+                except Exception as e:
+                    print(f"Speculative search failed, searching rewritten query instead: {e}")
+            else:
+                speculative.cancel()
+            self.discarded += 1
+
+        return resolved_query, await search(resolved_query), False
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "reused": self.reused, "discarded": self.discarded}
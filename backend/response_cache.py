@@ -0,0 +1,190 @@
+import hashlib
+import os
+import zlib
+from typing import Dict, List, Optional
+
+from search_cache import TTLCache, normalize_query
+
+# === Response Cache Settings ===
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# How many trailing history turns make an answer context-dependent, per flow
+RESPONSE_CACHE_HISTORY_TURNS = {"greeting": 0, "llm": int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "2"))}
+# Near-duplicate lookup on hashed character n-gram vectors (requires numpy). Trigram similarity alone
+# cannot tell "austria" from "australia" or "celsius to fahrenheit" from the reverse, so a near-duplicate
+# must also have the same numbers and content words in the same order, up to one typo in words of
+# TYPO_MIN_CHARS or more
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "0") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+TYPO_MIN_CHARS = 5
+EMBEDDING_DIM = 512
+SEMANTIC_BUCKET_SIZE = 256
+REPLAY_CHUNK_CHARS = 256
+
+STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did of in on at to for from by with about as and or "
+    "what whats which who whom how why when where can could would should will i me my you your it its "
+    "this that these those there please tell give show".split()
+)
+
+
+def history_fingerprint(chat_history: Optional[List[dict]], turns: int) -> str:
+    if not turns or not chat_history:
+        return ""
+    tail = "\x1e".join(f"{t['role']}\x1f{t['message']}" for t in chat_history[-turns:])
+    return hashlib.sha1(tail.encode()).hexdigest()
+
+
+def content_terms(text: str) -> List[str]:
+    """Numbers and content words of a normalized query, in order; words lose a plural s"""
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.isdigit() else word
+        for word in text.split() if word not in STOPWORDS and (len(word) > 1 or word.isdigit())
+    ]
+
+
+def _one_typo(a: str, b: str) -> bool:
+    """Same word up to one substituted, inserted or deleted character"""
+    if min(len(a), len(b)) < TYPO_MIN_CHARS or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i + (len(a) == len(b)):] == b[i + 1:]
+
+
+def same_terms(a: str, b: str) -> bool:
+    terms_a, terms_b = content_terms(a), content_terms(b)
+    return len(terms_a) == len(terms_b) and all(
+        x == y or (not x.isdigit() and not y.isdigit() and _one_typo(x, y)) for x, y in zip(terms_a, terms_b)
+    )
+
+
+def replay_chunks(text: str, size: int = REPLAY_CHUNK_CHARS) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class SemanticIndex:
+    """Cosine lookup over hashed character trigram vectors, one small matrix per bucket"""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, bucket_size: int = SEMANTIC_BUCKET_SIZE):
+        import numpy as np
+        self.np = np
+        self.dim = dim
+        self.bucket_size = bucket_size
+        self._buckets: Dict[tuple, tuple] = {}
+
+    def embed(self, text: str):
+        vector = self.np.zeros(self.dim, dtype=self.np.float32)
+        padded = f"  {text} "
+        for i in range(len(padded) - 2):
+            # crc32 rather than hash(): stable across processes and restarts
+            vector[zlib.crc32(padded[i:i + 3].encode()) % self.dim] += 1.0
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, bucket: tuple, key: tuple, text: str):
+        keys, matrix = self._buckets.get(bucket, ([], self.np.empty((0, self.dim), dtype=self.np.float32)))
+        if key in keys:
+            return
+        keys = (keys + [key])[-self.bucket_size:]
+        matrix = self.np.vstack([matrix, self.embed(text)])[-self.bucket_size:]
+        self._buckets[bucket] = (keys, matrix)
+
+    def remove(self, bucket: tuple, key: tuple):
+        """Forget one key; a bucket goes with its last key"""
+        entry = self._buckets.get(bucket)
+        if entry is None or key not in entry[0]:
+            return
+        keys, matrix = entry
+        row = keys.index(key)
+        if len(keys) == 1:
+            del self._buckets[bucket]
+        else:
+            self._buckets[bucket] = (keys[:row] + keys[row + 1:], self.np.delete(matrix, row, axis=0))
+
+    def nearest(self, bucket: tuple, text: str, threshold: float, accept=None) -> Optional[tuple]:
+        """Most similar key at or above threshold (that accept(key) approves, if given)"""
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            return None
+        keys, matrix = entry
+        scores = matrix @ self.embed(text)
+        for row in scores.argsort()[::-1]:
+            if scores[row] < threshold:
+                return None
+            if accept is None or accept(keys[row]):
+                return keys[row]
+        return None
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ResponseCache:
+    """Caches complete answers keyed on flow, normalized prompt text and a history fingerprint"""
+
+    def __init__(self, ttl: int = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 semantic: bool = RESPONSE_CACHE_SEMANTIC, similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.entries = TTLCache(max_entries, ttl, on_evict=self._evicted)
+        self.similarity = similarity
+        self.semantic = None
+        if semantic:
+            try:
+                self.semantic = SemanticIndex()
+            except ImportError:
+                print("RESPONSE_CACHE_SEMANTIC is set but numpy is not installed; using exact matching only")
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def _evicted(self, key: tuple):
+        if self.semantic is not None:
+            self.semantic.remove(key[:-1], key)
+
+    def _bucket(self, flow: str, chat_history: Optional[List[dict]]) -> tuple:
+        return flow, history_fingerprint(chat_history, RESPONSE_CACHE_HISTORY_TURNS.get(flow, 0))
+
+    def lookup(self, flow: str, text: str, chat_history: Optional[List[dict]]) -> Optional[str]:
+        bucket = self._bucket(flow, chat_history)
+        normalized = normalize_query(text)
+        entry = self.entries.get(bucket + (normalized,))
+        if entry is not None:
+            self.hits_exact += 1
+        elif self.semantic is not None:
+            key = self.semantic.nearest(bucket, normalized, self.similarity,
+                                        accept=lambda candidate: same_terms(normalized, candidate[-1]))
+            entry = self.entries.get(key) if key is not None else None
+            if entry is not None:
+                self.hits_semantic += 1
+
+        if entry is None:
+            self.misses += 1
+            return None
+        answer, generation_seconds = entry
+        self.seconds_saved += generation_seconds
+        return answer
+
+    def store(self, flow: str, text: str, chat_history: Optional[List[dict]], answer: str, generation_seconds: float):
+        bucket = self._bucket(flow, chat_history)
+        normalized = normalize_query(text)
+        self.entries.set(bucket + (normalized,), (answer, generation_seconds))
+        if self.semantic is not None:
+            self.semantic.add(bucket, bucket + (normalized,), normalized)
+
+    def stats(self) -> Dict:
+        hits = self.hits_exact + self.hits_semantic
+        lookups = hits + self.misses
+        return {
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.seconds_saved, 3),
+            "entries": len(self.entries),
+            "semantic_buckets": len(self.semantic) if self.semantic is not None else 0,
+        }
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import uuid
+from collections import deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from search_cache import TTLCache
+from sse import ClientDisconnected, DisconnectWatch, frame
+
+# === Resumable Stream Settings ===
+# Generations run detached from the HTTP response and keep their frames in a ring buffer, so an
+# EventSource that reconnects with Last-Event-ID resumes instead of starting a new generation.
+# The buffers live in the worker that started the generation, so this is off by default: enable it
+# only with a single worker or sticky routing, otherwise most reconnects land elsewhere and expire
+RESUMABLE_STREAMS_ENABLED = os.getenv("RESUMABLE_STREAMS_ENABLED", "0") == "1"
+RESUME_BUFFER_FRAMES = int(os.getenv("RESUME_BUFFER_FRAMES", "4096"))
+# How long a finished generation stays resumable
+RESUME_TTL_SECONDS = float(os.getenv("RESUME_TTL_SECONDS", "60"))
+# How long a generation keeps running with no client attached before it is cancelled
+RESUME_GRACE_SECONDS = float(os.getenv("RESUME_GRACE_SECONDS", "5"))
+RESUME_MAX_STREAMS = int(os.getenv("RESUME_MAX_STREAMS", "2000"))
+# Bounds the registry entry of a generation that never finishes
+RESUME_MAX_LIFETIME_SECONDS = float(os.getenv("RESUME_MAX_LIFETIME_SECONDS", "900"))
+
+ENDED_FRAME = frame({"error": "The reply stream ended before it finished", "is_finished": True})
+EXPIRED_FRAME = frame({"error": "This reply can no longer be resumed", "is_finished": True})
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Split a Last-Event-ID of the form "<generation>:<seq>" """
+    if not value:
+        return None
+    generation_id, _, seq = value.strip().rpartition(":")
+    if not generation_id or not seq.isdigit():
+        return None
+    return generation_id, int(seq)
+
+
+class Generation:
+    """One streamed reply: its SSE frames, numbered from 1, in a bounded ring buffer"""
+
+    def __init__(self, owner: Tuple[str, str], max_frames: int, grace: float):
+        self.id = uuid.uuid4().hex[:16]
+        self.owner = owner
+        self.grace = grace
+        self.frames = deque(maxlen=max_frames)
+        self.next_seq = 1
+        self.done = False
+        self.abandoned = False
+        self.consumers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._idle_timer = None
+        self._changed = asyncio.Condition()
+
+    async def append(self, data: bytes):
+        async with self._changed:
+            self.frames.append(b"id: %s:%d\n" % (self.id.encode(), self.next_seq) + data)
+            self.next_seq += 1
+            self._changed.notify_all()
+
+    async def close(self):
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+
+    def _abandon(self):
+        self._idle_timer = None
+        if self.consumers == 0 and not self.done and self.task is not None:
+            self.abandoned = True
+            self.task.cancel()
+
+    async def follow(self, after: int, watch: DisconnectWatch) -> AsyncIterator[bytes]:
+        """Frames after seq `after`, live until the generation is done"""
+        self.consumers += 1
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        position = after
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self.next_seq > position + 1 or self.done)
+                    first_seq = self.next_seq - len(self.frames)
+                    if position + 1 < first_seq:
+                        # The client fell further behind than the ring buffer reaches
+                        pending = None
+                    else:
+                        pending = [self.frames[i] for i in range(position + 1 - first_seq, len(self.frames))]
+                    done = self.done
+                if pending is None:
+                    yield EXPIRED_FRAME
+                    return
+                for data in pending:
+                    yield data
+                    await watch.check()
+                position += len(pending)
+                if done:
+                    if self.abandoned:
+                        yield ENDED_FRAME
+                    return
+        except ClientDisconnected:
+            return
+        finally:
+            self.consumers -= 1
+            if self.consumers == 0 and not self.done:
+                # Give EventSource time to reconnect before the generation is cancelled
+                self._idle_timer = asyncio.get_running_loop().call_later(self.grace, self._abandon)
+
+
+class ResumableStreams:
+    """Registry of running and recently finished generations of this worker"""
+
+    def __init__(self, max_frames: int = RESUME_BUFFER_FRAMES, ttl: float = RESUME_TTL_SECONDS,
+                 grace: float = RESUME_GRACE_SECONDS, max_streams: int = RESUME_MAX_STREAMS):
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.grace = grace
+        self.generations = TTLCache(max_streams, RESUME_MAX_LIFETIME_SECONDS)
+        self._tasks = set()
+        self.started = 0
+        self.resumed = 0
+        self.expired = 0
+        self.abandoned = 0
+
+    def start(self, frames: AsyncIterator[bytes], owner: Tuple[str, str]) -> Generation:
+        generation = Generation(owner, self.max_frames, self.grace)
+        generation.task = asyncio.create_task(self._pump(generation, frames))
+        self._tasks.add(generation.task)
+        generation.task.add_done_callback(self._tasks.discard)
+        self.generations.set(generation.id, generation)
+        self.started += 1
+        return generation
+
+    async def _pump(self, generation: Generation, frames: AsyncIterator[bytes]):
+        try:
+            async for data in frames:
+                await generation.append(data)
+        except asyncio.CancelledError:
+            self.abandoned += 1
+        finally:
+            await generation.close()
+            self.generations.set(generation.id, generation, ttl=self.ttl)
+
+    def resume(self, last_event_id: Optional[str], owner: Tuple[str, str], watch: DisconnectWatch) -> Optional[AsyncIterator[bytes]]:
+        """Frames after Last-Event-ID, or None when the header does not name a generation"""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        generation_id, seq = parsed
+        generation = self.generations.get(generation_id)
+        if generation is None or generation.owner != owner:
+            self.expired += 1
+            return self._expired()
+        self.resumed += 1
+        return generation.follow(seq, watch)
+
+    async def _expired(self) -> AsyncIterator[bytes]:
+        yield EXPIRED_FRAME
+
+    def stats(self) -> Dict:
+        return {
+            "active": len(self._tasks),
+            "started": self.started,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "abandoned": self.abandoned,
+        }
@@ -0,0 +1,291 @@
+import asyncio
+import codecs
+import ipaddress
+import math
+import os
+import re
+import socket
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Dict, List, NamedTuple
+from urllib.parse import urlsplit
+
+from history_window import estimate_tokens
+from http_client import AsyncHTTPClient, http
+from upstream import remaining_budget
+
+# === Retrieval Settings ===
+# Fetch the top result pages and send the best-matching passages instead of the bare snippets.
+# Opt-in: it can hold the first token back by up to RETRIEVAL_DEADLINE_SECONDS
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "0") == "1"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+# Deadline for all page fetches together; text extracted so far is still used when it passes
+RETRIEVAL_DEADLINE_SECONDS = float(os.getenv("RETRIEVAL_DEADLINE_SECONDS", "2.5"))
+RETRIEVAL_MAX_BYTES = int(os.getenv("RETRIEVAL_MAX_BYTES", str(512 * 1024)))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1200"))
+PASSAGE_WORDS = int(os.getenv("RETRIEVAL_PASSAGE_WORDS", "80"))
+RETRIEVAL_MAX_REDIRECTS = int(os.getenv("RETRIEVAL_MAX_REDIRECTS", "5"))
+# Result links are arbitrary URLs: loopback, private and link-local targets are refused, also after a redirect
+RETRIEVAL_ALLOW_PRIVATE = os.getenv("RETRIEVAL_ALLOW_PRIVATE", "0") == "1"
+
+_SKIPPED_TAGS = {"title", "script", "style", "noscript", "svg", "nav", "header", "footer", "aside", "form",
+                 "template", "iframe"}
+_BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "h1", "h2", "h3", "h4", "h5", "h6",
+               "br", "tr", "td", "blockquote", "pre", "dd", "dt"}
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its of on or she that the their "
+    "them they this to was were what when where which who will with you your".split()
+)
+
+
+class Passage(NamedTuple):
+    text: str
+    title: str
+    link: str
+
+
+class TextExtractor(HTMLParser):
+    """Incremental main-text extraction: feed() chunks as they arrive, read blocks at any time"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[str] = []
+        self._current: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._end_block()
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self._end_block()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self._end_block()
+
+    def handle_data(self, data):
+        if self._skip_depth == 0:
+            self._current.append(data)
+
+    def _end_block(self):
+        text = " ".join("".join(self._current).split())
+        self._current = []
+        # Menus, buttons and captions are short; prose blocks are what answers questions
+        if len(text) >= 40:
+            self.blocks.append(text)
+
+    def text(self) -> str:
+        self._end_block()
+        return "\n".join(self.blocks)
+
+
+class BlockedTarget(Exception):
+    """A result page, or a redirect, pointing somewhere other than a public http(s) address"""
+
+
+def check_address(hostname: str, value: str):
+    address = ipaddress.ip_address(value.split("%")[0])
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+        raise BlockedTarget(f"{hostname} resolves to non-public address {address}")
+
+
+async def check_public(url: str):
+    """Raise BlockedTarget unless every address the URL's host resolves to is public"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise BlockedTarget(f"Not an http(s) URL: {url}")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise BlockedTarget(f"Cannot resolve {parts.hostname}: {e}") from e
+    for *_, sockaddr in infos:
+        check_address(parts.hostname, sockaddr[0])
+
+
+def peer_check(hostname: str):
+    """httpcore trace hook that checks the address a new connection actually reached.
+
+    httpx resolves the host again when it connects, so a name that turned
+    private after check_public (DNS rebinding) is caught here, before the
+    request is written to the socket.
+    """
+    async def trace(event: str, info: dict):
+        if event != "connection.connect_tcp.complete":
+            return
+        stream = info["return_value"]
+        try:
+            check_address(hostname, stream.get_extra_info("server_addr")[0])
+        except BlockedTarget:
+            await stream.aclose()
+            raise
+    return trace
+
+
+async def fetch_text(url: str, extractor: TextExtractor, max_bytes: int, client: AsyncHTTPClient = http,
+                     allow_private: bool = RETRIEVAL_ALLOW_PRIVATE):
+    """Stream a page into the extractor until it ends or max_bytes have been read.
+
+    Redirects are followed here rather than by httpx, so that every hop is
+    checked before it is requested.
+    """
+    for _ in range(RETRIEVAL_MAX_REDIRECTS + 1):
+        extensions = {}
+        if not allow_private:
+            await check_public(url)
+            extensions["trace"] = peer_check(urlsplit(url).hostname)
+        async with client.stream("GET", url, per_host=False, follow_redirects=False, extensions=extensions,
+                                 headers={"Accept": "text/html,text/plain;q=0.9"}) as response:
+            if response.is_redirect:
+                url = str(response.url.join(response.headers["location"]))
+                continue
+            content_type = response.headers.get("content-type", "")
+            if response.status_code != 200 or not content_type.startswith(("text/html", "text/plain")):
+                return
+            decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+            received = 0
+            async for chunk in response.aiter_bytes():
+                received += len(chunk)
+                extractor.feed(decoder.decode(chunk))
+                if received >= max_bytes:
+                    break
+            return
+    raise BlockedTarget(f"More than {RETRIEVAL_MAX_REDIRECTS} redirects")
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def split_passages(text: str, words: int = PASSAGE_WORDS) -> List[str]:
+    """Windows of about `words` words with a half-window overlap"""
+    tokens = text.split()
+    if len(tokens) <= words:
+        return [" ".join(tokens)] if tokens else []
+    step = max(1, words // 2)
+    return [" ".join(tokens[start:start + words]) for start in range(0, len(tokens) - step, step)]
+
+
+def bm25_rank(query: str, passages: List[Passage], k1: float = 1.2, b: float = 0.75) -> List[Passage]:
+    """Passages sharing at least one query term, best BM25 score first"""
+    query_terms = set(tokenize(query))
+    documents = [Counter(tokenize(passage.text)) for passage in passages]
+    if not query_terms or not documents:
+        return []
+    average_length = sum(sum(doc.values()) for doc in documents) / len(documents) or 1
+    document_frequency = Counter(term for doc in documents for term in query_terms if term in doc)
+    scored = []
+    for passage, doc in zip(passages, documents):
+        length = sum(doc.values())
+        score = 0.0
+        for term in query_terms:
+            frequency = doc.get(term)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        if score > 0:
+            scored.append((score, passage))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [passage for _, passage in scored]
+
+
+def fit_passages(ranked: List[Passage], token_budget: int) -> List[Passage]:
+    chosen = []
+    used = 0
+    for passage in ranked:
+        cost = estimate_tokens(passage.text)
+        if used + cost > token_budget:
+            continue
+        chosen.append(passage)
+        used += cost
+    return chosen
+
+
+class Retriever:
+    """Fetches result pages concurrently and keeps the passages that best match the query"""
+
+    def __init__(self, client: AsyncHTTPClient = http, top_k: int = RETRIEVAL_TOP_K,
+                 deadline: float = RETRIEVAL_DEADLINE_SECONDS, max_bytes: int = RETRIEVAL_MAX_BYTES,
+                 token_budget: int = RETRIEVAL_TOKEN_BUDGET, allow_private: bool = RETRIEVAL_ALLOW_PRIVATE):
+        self.client = client
+        self.top_k = top_k
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.token_budget = token_budget
+        self.allow_private = allow_private
+        self.pages_fetched = 0
+        self.pages_timed_out = 0
+        self.pages_failed = 0
+        self.pages_blocked = 0
+
+    async def fetch_pages(self, results: List[dict]) -> List[Passage]:
+        targets = [item for item in results[:self.top_k] if item.get("link", "").startswith(("http://", "https://"))]
+        extractors = [TextExtractor() for _ in targets]
+        tasks = [
+            asyncio.create_task(fetch_text(item["link"], extractor, self.max_bytes, self.client, self.allow_private))
+            for item, extractor in zip(targets, extractors)
+        ]
+        timeout = self.deadline
+        remaining = remaining_budget()
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+        if tasks:
+            try:
+                done, pending = await asyncio.wait(tasks, timeout=timeout)
+            finally:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self.pages_timed_out += len(pending)
+            for task in done:
+                if isinstance(task.exception(), BlockedTarget):
+                    self.pages_blocked += 1
+                elif task.exception() is not None:
+                    self.pages_failed += 1
+                else:
+                    self.pages_fetched += 1
+
+        passages = []
+        for item, extractor in zip(targets, extractors):
+            # Pages cut off by the deadline still contribute what was parsed so far
+            for text in split_passages(extractor.text()):
+                passages.append(Passage(text, item.get("title", ""), item["link"]))
+        return passages
+
+    async def build_context(self, query: str, results: List[dict]) -> str:
+        """Best passages (and result snippets) for the query within the token budget, grouped by source"""
+        passages = [
+            Passage(f"{item.get('title', '')}: {item.get('snippet', '')}", item.get("title", ""), item.get("link", ""))
+            for item in results if item.get("snippet")
+        ]
+        passages += await self.fetch_pages(results)
+        chosen = fit_passages(bm25_rank(query, passages), self.token_budget)
+        if not chosen:
+            chosen = fit_passages(passages, self.token_budget)
+
+        by_link: Dict[str, List[Passage]] = {}
+        for passage in chosen:
+            by_link.setdefault(passage.link, []).append(passage)
+        sections = [
+            f"[{number}] {group[0].title}\n{link}\n" + "\n".join(f"- {passage.text}" for passage in group)
+            for number, (link, group) in enumerate(by_link.items(), 1)
+        ]
+        return "\n\n".join(sections)
+
+    def stats(self) -> Dict:
+        return {
+            "pages_fetched": self.pages_fetched,
+            "pages_timed_out": self.pages_timed_out,
+            "pages_failed": self.pages_failed,
+            "pages_blocked": self.pages_blocked,
+        }
+
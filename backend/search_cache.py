@@ -0,0 +1,119 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# === Search Cache Settings ===
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+# Share results between workers/nodes through a Mongo collection with a TTL index
+SEARCH_CACHE_SHARED = os.getenv("SEARCH_CACHE_SHARED", "0") == "1"
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Case, punctuation and spacing variants of the same query map to one key"""
+    query = _PUNCTUATION.sub(" ", query.lower())
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+class TTLCache:
+    """In-process LRU map whose entries also expire after ttl seconds; on_evict(key) sees every key that leaves"""
+
+    def __init__(self, max_entries: int, ttl: float, on_evict: Optional[Callable[[Hashable], None]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self.pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self.pop(next(iter(self._data)))
+
+    def pop(self, key: Hashable):
+        if self._data.pop(key, None) is not None and self.on_evict is not None:
+            self.on_evict(key)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SearchCache:
+    """Two-tier cache in front of a web search call, keyed on the normalized query"""
+
+    def __init__(self, search: Callable[[str], Awaitable[Dict]], shared=None,
+                 ttl: int = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.search = search
+        self.shared = shared
+        self.ttl = ttl
+        self.local = TTLCache(max_entries, ttl)
+        self.hits_local = 0
+        self.hits_shared = 0
+        self.misses = 0
+
+    async def get_or_search(self, query: str) -> Dict:
+        key = normalize_query(query)
+        result = self.local.get(key)
+        if result is not None:
+            self.hits_local += 1
+            return result
+
+        if self.shared is not None:
+            try:
+                doc = await self.shared.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+            except Exception as e:
+                print(f"Search cache shared tier read failed: {e}")
+                doc = None
+            if doc is not None:
+                self.hits_shared += 1
+                self.local.set(key, doc["result"])
+                return doc["result"]
+
+        self.misses += 1
+        # Errors propagate uncached so the next request retries upstream
+        result = await self.search(query)
+        self.local.set(key, result)
+        if self.shared is not None:
+            try:
+                await self.shared.replace_one(
+                    {"_id": key},
+                    {"_id": key, "result": result, "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)},
+                    upsert=True
+                )
+            except Exception as e:
+                print(f"Search cache shared tier write failed: {e}")
+        return result
+
+    def put(self, query: str, result: Dict):
+        """Seed the local tier, e.g. with a result obtained for an equivalent query"""
+        self.local.set(normalize_query(query), result)
+
+    def stats(self) -> Dict:
+        lookups = self.hits_local + self.hits_shared + self.misses
+        return {
+            "hits_local": self.hits_local,
+            "hits_shared": self.hits_shared,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits_local + self.hits_shared) / lookups, 4) if lookups else 0.0,
+            "entries": len(self.local),
+        }
@@ -0,0 +1,71 @@
+"""Production entry point for the chat API.
+
+    python server.py
+
+Runs gunicorn with uvicorn workers when gunicorn is installed, otherwise
+uvicorn's own multi-process mode. Every setting comes from the environment
+(optionally a .env file). Workers import the app after they start, so each
+one builds its own MongoDB and HTTP connection pools.
+"""
+import os
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+# === Server Settings ===
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+SERVER = os.getenv("SERVER", "gunicorn")
+KEEPALIVE_SECONDS = int(os.getenv("KEEPALIVE_SECONDS", "75"))
+GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("GRACEFUL_TIMEOUT_SECONDS", "30"))
+APP = "mongo_apis1:app"
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class ChatServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{HOST}:{PORT}")
+            self.cfg.set("workers", WORKERS)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            # Not preloaded: the app (and its client pools) is imported in each worker after fork
+            self.cfg.set("preload_app", False)
+            self.cfg.set("keepalive", KEEPALIVE_SECONDS)
+            self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT_SECONDS)
+            # SSE streams are long-lived; let the graceful timeout bound shutdown instead
+            self.cfg.set("timeout", 0)
+
+        def load(self):
+            from mongo_apis1 import app
+            return app
+
+    ChatServer().run()
+
+
+def run_uvicorn():
+    import uvicorn
+    uvicorn.run(
+        APP,
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        timeout_keep_alive=KEEPALIVE_SECONDS,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    if SERVER == "gunicorn":
+        try:
+            run_gunicorn()
+        except ImportError:
+            print("gunicorn is not installed, falling back to uvicorn workers")
+            run_uvicorn()
+    else:
+        run_uvicorn()
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+
+def flight_key(*parts: Any) -> str:
+    """Stable digest of JSON-serializable call arguments"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight awaitable.
+
+    The shared call is cancelled once every caller waiting on it has been
+    cancelled, so an abandoned call (e.g. a discarded speculative search)
+    stops instead of running to completion for nobody.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.started = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+
+            def forget(_):
+                if self._calls.get(key) is task:
+                    del self._calls[key]
+                    del self._waiters[key]
+            task.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+
+        self._waiters[key] += 1
+        try:
+            # A cancelled caller must not cancel the call the others are waiting on
+            return await asyncio.shield(task)
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0 and not task.done():
+                    self.cancelled += 1
+                    task.cancel()
+                    del self._calls[key]
+                    del self._waiters[key]
+
+    def stats(self) -> Dict:
+        return {"started": self.started, "coalesced": self.coalesced, "cancelled": self.cancelled,
+                "in_flight": len(self._calls)}
+
+
+class _Broadcast:
+    def __init__(self, source: AsyncIterator[Any]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                async with self.changed:
+                    self.chunks.append(chunk)
+                    self.changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+
+class StreamFlight:
+    """Concurrent identical streaming calls share one upstream stream.
+
+    Every subscriber receives the full chunk sequence from the start, including
+    ones that join after the first chunks were produced. The upstream stream is
+    cancelled once its last subscriber goes away.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Broadcast] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def subscribe(self, key: Hashable, open_stream: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        flight = self._flights.get(key)
+        if flight is None:
+            self.started += 1
+            flight = _Broadcast(open_stream())
+            self._flights[key] = flight
+
+            def forget(_):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.task.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: position < len(flight.chunks) or flight.done)
+                    chunks = flight.chunks[position:]
+                    finished = flight.done
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if finished and position >= len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def stats(self) -> Dict:
+        return {"started": self.started, "coalesced": self.coalesced, "in_flight": len(self._flights)}
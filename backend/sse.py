@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator, NamedTuple, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# === Token Coalescing Settings ===
+# Defaults for clients that opt in with `coalesce=1` on GET /chat without their own values
+SSE_FLUSH_MS = int(os.getenv("SSE_FLUSH_MS", "50"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "512"))
+# How often a streaming response checks whether its client is still connected
+DISCONNECT_CHECK_MS = int(os.getenv("DISCONNECT_CHECK_MS", "250"))
+
+# Event kinds produced by the LLM stream
+TEXT = "text"
+END = "end"
+ERROR = "error"
+
+
+class StreamEvent(NamedTuple):
+    kind: str       # TEXT, END or ERROR
+    text: str = ""
+
+
+FINISHED = StreamEvent(END)
+
+if orjson is not None:
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+def frame(payload: dict) -> bytes:
+    """One pre-encoded SSE `data:` frame"""
+    return b"data: " + dumps(payload) + b"\n\n"
+
+
+def text_frame(text: str) -> bytes:
+    return b'data: {"response":' + dumps(text) + b"}\n\n"
+
+
+def parse_cohere_line(line: Union[str, bytes]) -> Optional[StreamEvent]:
+    """Decode one line of Cohere's streaming chat API; None for lines that carry nothing"""
+    try:
+        data = loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    event_type = data.get("event_type")
+    if event_type == "text-generation":
+        text = data.get("text")
+        return StreamEvent(TEXT, text) if text else None
+    if event_type == "stream-end":
+        return FINISHED
+    if event_type == "stream-start":
+        return None
+    # Legacy format
+    if data.get("text"):
+        return StreamEvent(TEXT, data["text"])
+    if data.get("is_finished"):
+        return FINISHED
+    return None
+
+
+class FlushPolicy(NamedTuple):
+    flush_ms: int = SSE_FLUSH_MS        # 0: no time-based flush
+    flush_bytes: int = SSE_FLUSH_BYTES  # 0: no size-based flush
+
+
+async def coalesce_events(events: AsyncIterator[StreamEvent], policy: FlushPolicy) -> AsyncIterator[StreamEvent]:
+    """Merge consecutive TEXT events into fewer, larger ones.
+
+    The first token is passed through at once (time to first token is not
+    traded away); after that text is buffered until `flush_ms` have passed
+    since the oldest buffered token or `flush_bytes` are buffered, whichever
+    comes first. The timer fires even while upstream is silent. Any other
+    event flushes the buffer first and is passed on unchanged.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer = []
+    size = 0
+    flush_at = None
+    first = True
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if flush_at is None else max(0.0, flush_at - loop.time())
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                yield StreamEvent(TEXT, "".join(buffer))
+                buffer, size, flush_at = [], 0, None
+                continue
+
+            finished, pending = pending, None
+            try:
+                event = finished.result()
+            except StopAsyncIteration:
+                break
+
+            if event.kind != TEXT:
+                if buffer:
+                    yield StreamEvent(TEXT, "".join(buffer))
+                    buffer, size, flush_at = [], 0, None
+                yield event
+            elif first:
+                first = False
+                yield event
+            else:
+                buffer.append(event.text)
+                size += len(event.text.encode())
+                if flush_at is None and policy.flush_ms > 0:
+                    flush_at = loop.time() + policy.flush_ms / 1000
+                if policy.flush_bytes > 0 and size >= policy.flush_bytes:
+                    yield StreamEvent(TEXT, "".join(buffer))
+                    buffer, size, flush_at = [], 0, None
+
+        if buffer:
+            yield StreamEvent(TEXT, "".join(buffer))
+    finally:
+        if pending is not None:
+            # Let the cancelled read unwind so the source is not running when it is closed
+            pending.cancel()
+            try:
+                await asyncio.wait((pending,))
+            except asyncio.CancelledError:
+                pass
+
+
+class ClientDisconnected(Exception):
+    """The client of a streaming response went away"""
+
+
+class DisconnectWatch:
+    """Rate-limited check of Request.is_disconnected() for the streaming hot path"""
+
+    def __init__(self, request=None, interval_ms: int = DISCONNECT_CHECK_MS):
+        self.request = request
+        self.interval = interval_ms / 1000
+        self._checked_at = 0.0
+        self.gone = False
+
+    async def check(self):
+        if self.request is None or self.gone:
+            return
+        loop = asyncio.get_running_loop()
+        if loop.time() - self._checked_at < self.interval:
+            return
+        self._checked_at = loop.time()
+        if await self.request.is_disconnected():
+            self.gone = True
+            raise ClientDisconnected()
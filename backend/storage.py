@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# === MongoDB Settings ===
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "chatdb")
+# "motor" (native async driver), "thread" (pymongo offloaded to a thread pool)
+# or "memory" (mongomock, for tests and local runs without a server)
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "thread")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+
+def pool_options() -> dict:
+    return {
+        # No sockets or monitor threads until first use, so a client built before a
+        # worker fork (e.g. gunicorn --preload) is still safe in the child
+        "connect": False,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+
+# === Thread-Offload Adapter ===
+# Mirrors the small subset of the Motor API the app uses, so either backend can be awaited the same way
+
+class AsyncCursor:
+    """Lazily built pymongo cursor whose iteration runs on the executor"""
+
+    def __init__(self, factory: Callable[[], Any], executor: ThreadPoolExecutor):
+        self._factory = factory
+        self._executor = executor
+        self._ops = []
+        self._cursor = None
+        self._batch = []
+
+    def _chain(self, name, *args, **kwargs):
+        self._ops.append((name, args, kwargs))
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self._chain("sort", *args, **kwargs)
+
+    def limit(self, *args, **kwargs):
+        return self._chain("limit", *args, **kwargs)
+
+    def skip(self, *args, **kwargs):
+        return self._chain("skip", *args, **kwargs)
+
+    def hint(self, *args, **kwargs):
+        return self._chain("hint", *args, **kwargs)
+
+    def batch_size(self, *args, **kwargs):
+        return self._chain("batch_size", *args, **kwargs)
+
+    def max_time_ms(self, *args, **kwargs):
+        return self._chain("max_time_ms", *args, **kwargs)
+
+    def _build(self):
+        cursor = self._factory()
+        for name, args, kwargs in self._ops:
+            cursor = getattr(cursor, name)(*args, **kwargs)
+        return cursor
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        def fetch():
+            cursor = self._build()
+            if length is None:
+                return list(cursor)
+            return [doc for _, doc in zip(range(length), cursor)]
+        return await self._run(fetch)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._batch:
+            if self._cursor is None:
+                self._cursor = await self._run(self._build)
+
+            def next_batch(cursor):
+                # Fetch up to a driver batch per executor hop instead of one document at a time
+                batch = []
+                for doc in cursor:
+                    batch.append(doc)
+                    if len(batch) >= 100:
+                        break
+                return batch
+
+            self._batch = await self._run(next_batch, self._cursor)
+            if not self._batch:
+                raise StopAsyncIteration
+            self._batch.reverse()
+        return self._batch.pop()
+
+
+class AsyncCollection:
+    def __init__(self, collection, executor: ThreadPoolExecutor):
+        self.delegate = collection
+        self._executor = executor
+
+    @property
+    def name(self) -> str:
+        return self.delegate.name
+
+    def find(self, *args, **kwargs) -> AsyncCursor:
+        return AsyncCursor(partial(self.delegate.find, *args, **kwargs), self._executor)
+
+    def aggregate(self, pipeline, **kwargs) -> AsyncCursor:
+        return AsyncCursor(partial(self.delegate.aggregate, pipeline, **kwargs), self._executor)
+
+    def __getattr__(self, name):
+        method = getattr(self.delegate, name)
+
+        async def offloaded(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(method, *args, **kwargs))
+        return offloaded
+
+
+class AsyncDatabase:
+    def __init__(self, database, executor: ThreadPoolExecutor):
+        self.delegate = database
+        self._executor = executor
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> AsyncCollection:
+        if name not in self._collections:
+            self._collections[name] = AsyncCollection(self.delegate[name], self._executor)
+        return self._collections[name]
+
+    def close(self):
+        self.delegate.client.close()
+        self._executor.shutdown(wait=False)
+
+
+# === Index Bootstrap ===
+# collection -> [(keys, options)], created on startup and by the backfill script
+INDEXES = {
+    "chat_history": [
+        # Only messages whose insights update failed carry the field
+        ([("insights_pending", 1)], {"sparse": True}),
+        # _id breaks created_at ties, so keyset pages on (created_at, _id) are read off the index without a sort
+        ([("username", 1), ("session_id", 1), ("created_at", 1), ("_id", 1)], {}),
+        # Text index with an equality prefix: /search only walks one user's postings
+        ([("username", 1), ("message", "text")], {"default_language": "english"}),
+    ],
+    "sessions": [
+        ([("username", 1), ("session_id", 1)], {"unique": True}),
+        ([("username", 1), ("created_at", -1), ("_id", -1)], {}),
+    ],
+    "users": [
+        ([("username", 1)], {}),
+    ],
+    "search_cache": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "invalidations": [
+        ([("created_at", 1)], {"expireAfterSeconds": 3600}),
+    ],
+    "batch_jobs": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "batch_results": [
+        ([("job_id", 1), ("seq", 1)], {}),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "locks": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "auth_tokens": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+}
+
+
+async def insert_new(collection, docs: List[dict]) -> List[dict]:
+    """Unordered insert_many that skips documents whose _id already exists; returns the ones inserted"""
+    try:
+        await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Retried write-behind batches and re-imported dumps hit ids that already landed; anything else is a real failure
+        details = e.details or {}
+        if details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in details.get("writeErrors", [])):
+            raise
+        duplicates = {err["index"] for err in details.get("writeErrors", [])}
+        return [doc for i, doc in enumerate(docs) if i not in duplicates]
+    return docs
+
+
+# === Apply-Once Updates ===
+# Summary documents remember the keys of the last batches applied to them; a retried batch with the same
+# key matches nothing, and its upsert then fails on the unique key instead of counting twice
+APPLIED_BATCHES_KEPT = int(os.getenv("APPLIED_BATCHES_KEPT", "50"))
+
+
+def batch_key(docs: List[dict]) -> str:
+    """Stable key of a set of messages, whatever their order"""
+    return hashlib.sha1(",".join(sorted(str(doc["_id"]) for doc in docs)).encode()).hexdigest()[:20]
+
+
+def update_once(filter: dict, update: dict, key: str) -> UpdateOne:
+    """Upsert applied at most once per key to the matched document"""
+    update = dict(update)
+    update["$push"] = {"applied_batches": {"$each": [key], "$slice": -APPLIED_BATCHES_KEPT}}
+    return UpdateOne(dict(filter, applied_batches={"$ne": key}), update, upsert=True)
+
+
+async def bulk_write_once(collection, operations: List[UpdateOne]) -> Dict[int, Any]:
+    """Unordered bulk_write of update_once() operations; returns op index -> _id of the upserted documents"""
+    try:
+        result = await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate keys are operations that were already applied; anything else is a real failure
+        details = e.details or {}
+        if details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in details.get("writeErrors", [])):
+            raise
+        return {item["index"]: item["_id"] for item in details.get("upserted", [])}
+    return result.upserted_ids
+
+
+# collection -> names of indexes replaced by a longer one in INDEXES, dropped on startup
+SUPERSEDED_INDEXES = {
+    "chat_history": ["username_1_session_id_1_created_at_1"],
+    "sessions": ["username_1_created_at_-1"],
+}
+
+
+# === Lease Locks ===
+async def acquire_lock(collection, name: str, seconds: float) -> Optional[str]:
+    """Take the named lease unless another holder's has not expired yet; returns the owner token, or None"""
+    owner = uuid.uuid4().hex
+    now = datetime.utcnow()
+    try:
+        # A live lease does not match, so the upsert collides with it on _id
+        await collection.update_one(
+            {"_id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+    return owner
+
+
+async def release_lock(collection, name: str, owner: str):
+    await collection.delete_one({"_id": name, "owner": owner})
+
+
+async def ensure_indexes(database):
+    for name, specs in INDEXES.items():
+        for keys, options in specs:
+            await database[name].create_index(keys, **options)
+    for name, indexes in SUPERSEDED_INDEXES.items():
+        existing = await database[name].index_information()
+        for index in indexes:
+            if index in existing:
+                await database[name].drop_index(index)
+
+
+# === Backend Selection ===
+def connect_database(backend: str = MONGO_BACKEND, uri: str = MONGO_URI, name: str = MONGO_DB):
+    """Return an awaitable database handle for the configured backend"""
+    if backend == "motor":
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(uri, **pool_options())[name]
+
+    # One thread per pooled connection: more threads would only queue on the pool
+    executor = ThreadPoolExecutor(max_workers=MONGO_MAX_POOL_SIZE, thread_name_prefix="mongo")
+    if backend == "memory":
+        import mongomock
+        return AsyncDatabase(mongomock.MongoClient()[name], executor)
+    if backend == "thread":
+        return AsyncDatabase(MongoClient(uri, **pool_options())[name], executor)
+    raise ValueError(f"Unknown MONGO_BACKEND: {backend}")
+
+
+def close_database(database):
+    if isinstance(database, AsyncDatabase):
+        database.close()
+    else:
+        database.client.close()
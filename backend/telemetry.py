@@ -0,0 +1,186 @@
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+# === Logging ===
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of per-chunk debug records actually emitted when LOG_LEVEL=DEBUG
+DEBUG_SAMPLE_RATE = float(os.getenv("DEBUG_SAMPLE_RATE", "0.01"))
+
+logger = logging.getLogger("chatbot")
+logger.setLevel(LOG_LEVEL)
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler)
+
+# Resolved once so hot paths can skip the call entirely: `if DEBUG_ENABLED: debug(...)`
+DEBUG_ENABLED = logger.isEnabledFor(logging.DEBUG)
+
+
+def debug(msg: str, *args, sample: float = DEBUG_SAMPLE_RATE):
+    """Level-gated, sampled debug record; args are only formatted if the record is emitted"""
+    if DEBUG_ENABLED and (sample >= 1 or random.random() < sample):
+        logger.debug(msg, *args)
+
+
+# === Prometheus-style Metrics ===
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                labels = _label_text(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "chat_requests_total", "Chat requests by routed flow and outcome", ("flow", "outcome")))
+CHAT_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "chat_stage_seconds", "Time spent per /chat pipeline stage", ("flow", "stage")))
+CHAT_TTFT_SECONDS = REGISTRY.register(Histogram(
+    "chat_time_to_first_token_seconds", "Request start to first streamed token", ("flow",)))
+CHAT_STREAM_SECONDS = REGISTRY.register(Histogram(
+    "chat_stream_duration_seconds", "Generation start to end of stream", ("flow",)))
+CHAT_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "chat_tokens_per_second", "Streamed chunks per second after the first token", ("flow",), buckets=RATE_BUCKETS))
+CHAT_TOKENS_SAVED = REGISTRY.register(Counter(
+    "chat_tokens_saved_total",
+    "Estimated LLM tokens not generated because the client disconnected mid-stream", ("flow",)))
+UPSTREAM_CALLS = REGISTRY.register(Counter(
+    "upstream_calls_total", "Upstream HTTP attempts by provider and result", ("provider", "result")))
+BATCH_ITEMS = REGISTRY.register(Counter(
+    "batch_items_total", "Batch job items answered, by result", ("result",)))
+
+
+# Running mean of streamed tokens per completed reply, per flow; the baseline for tokens saved
+_reply_tokens: Dict[str, float] = {}
+
+
+class RequestTrace:
+    """Per-request stage timings, observed into the histograms when the request finishes.
+
+    The flow label is only known after routing, so stage durations are kept on
+    the trace and recorded in one go by finish().
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.flow = "unknown"
+        self.stages: Dict[str, float] = {}
+        self.generation_started = None
+        self.first_token_at = None
+        self.tokens = 0
+        self.finished = False
+
+    @contextmanager
+    def stage(self, name: str):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - began
+
+    async def timed(self, name: str, awaitable):
+        with self.stage(name):
+            return await awaitable
+
+    def start_generation(self):
+        self.generation_started = time.perf_counter()
+
+    def token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+
+    def finish(self, outcome: str = "ok"):
+        if self.finished:
+            return
+        self.finished = True
+        now = time.perf_counter()
+        CHAT_REQUESTS.inc(flow=self.flow, outcome=outcome)
+        if outcome == "ok" and self.tokens:
+            mean = _reply_tokens.get(self.flow)
+            _reply_tokens[self.flow] = self.tokens if mean is None else mean + 0.1 * (self.tokens - mean)
+        elif outcome == "cancelled" and self.flow in _reply_tokens:
+            CHAT_TOKENS_SAVED.inc(max(0.0, _reply_tokens[self.flow] - self.tokens), flow=self.flow)
+        for stage, seconds in self.stages.items():
+            CHAT_STAGE_SECONDS.observe(seconds, flow=self.flow, stage=stage)
+        if self.first_token_at is not None:
+            CHAT_TTFT_SECONDS.observe(self.first_token_at - self.started, flow=self.flow)
+            streaming = now - self.first_token_at
+            if streaming > 0:
+                CHAT_TOKENS_PER_SECOND.observe(self.tokens / streaming, flow=self.flow)
+        if self.generation_started is not None:
+            CHAT_STREAM_SECONDS.observe(now - self.generation_started, flow=self.flow)
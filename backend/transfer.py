@@ -0,0 +1,291 @@
+"""Streaming NDJSON export and import of chat_history.
+
+Usage (from the backend directory, with MONGO_URI / MONGO_DB like the API server):
+    python transfer.py export [--username alice] [--out chat_history.ndjson.gz]
+    python transfer.py import chat_history.ndjson.gz [--username alice] [--summaries keep|replace|skip]
+
+One message per line in MongoDB relaxed extended JSON ($oid, $date), gzip
+compressed unless the file name does not end in .gz. Memory stays flat: the
+export reads a cursor in TRANSFER_BATCH_SIZE batches and the import applies
+TRANSFER_BATCH_SIZE documents at a time, whatever the size of the dump.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId, json_util
+from bson.json_util import JSONMode, JSONOptions
+
+# === Transfer Settings ===
+TRANSFER_BATCH_SIZE = int(os.getenv("TRANSFER_BATCH_SIZE", "1000"))
+TRANSFER_CHUNK_BYTES = int(os.getenv("TRANSFER_CHUNK_BYTES", str(64 * 1024)))
+TRANSFER_GZIP_LEVEL = int(os.getenv("TRANSFER_GZIP_LEVEL", "6"))
+TRANSFER_MAX_LINE_BYTES = int(os.getenv("TRANSFER_MAX_LINE_BYTES", str(1024 * 1024)))
+
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+# Session order keeps every conversation contiguous and walks the (username, session_id, created_at) index
+EXPORT_SORT = [("username", 1), ("session_id", 1), ("created_at", 1)]
+REQUIRED_FIELDS = {"username": str, "session_id": str, "role": str, "message": str, "created_at": datetime}
+ROLES = {"user", "assistant"}
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class TransferReport:
+    """Running counts of one export or import, with its throughput"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.docs = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.bytes = 0
+
+    def finish(self) -> "TransferReport":
+        self.finished = time.perf_counter()
+        return self
+
+    def as_dict(self) -> Dict:
+        seconds = (self.finished or time.perf_counter()) - self.started
+        return {
+            "docs": self.docs,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "docs_per_sec": round(self.docs / seconds, 1) if seconds > 0 else 0,
+        }
+
+
+# === Export ===
+def export_query(username: Optional[str] = None) -> dict:
+    return {"username": username} if username is not None else {}
+
+
+async def export_lines(collection, query: dict, report: TransferReport,
+                       batch_size: int = TRANSFER_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """NDJSON of the matching messages, in chunks of about TRANSFER_CHUNK_BYTES"""
+    # summarized is bookkeeping of the write path, not part of the message
+    cursor = collection.find(query, {"summarized": 0}).sort(EXPORT_SORT).batch_size(batch_size)
+    chunk = []
+    size = 0
+    async for doc in cursor:
+        line = json_util.dumps(doc, json_options=JSON_OPTIONS).encode() + b"\n"
+        chunk.append(line)
+        size += len(line)
+        report.docs += 1
+        if size >= TRANSFER_CHUNK_BYTES:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], report: TransferReport,
+                      level: int = TRANSFER_GZIP_LEVEL) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            report.bytes += len(data)
+            yield data
+    data = compressor.flush()
+    report.bytes += len(data)
+    yield data
+
+
+# === Import ===
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = TRANSFER_MAX_LINE_BYTES) -> AsyncIterator[bytes]:
+    """Non-empty lines of a plain or gzip (also multi-member) NDJSON byte stream.
+
+    Inflation is capped at TRANSFER_CHUNK_BYTES per step, so a small body
+    cannot expand into an unbounded buffer. Raises ValueError for a line
+    longer than max_line_bytes or a corrupt gzip stream.
+    """
+    decompressor = None
+    first = True
+    buffer = b""
+
+    def inflate(data: bytes):
+        nonlocal decompressor
+        while data:
+            try:
+                out = decompressor.decompress(data, TRANSFER_CHUNK_BYTES)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt gzip stream: {e}") from e
+            yield out
+            if decompressor.eof:
+                # Concatenated dumps are consecutive gzip members
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+            else:
+                data = decompressor.unconsumed_tail
+
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if chunk[:2] == GZIP_MAGIC:
+                decompressor = zlib.decompressobj(31)
+        pieces = inflate(chunk) if decompressor is not None else (chunk,)
+        for piece in pieces:
+            buffer += piece
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            if len(buffer) > max_line_bytes:
+                raise ValueError(f"Line longer than {max_line_bytes} bytes")
+            for line in lines:
+                if line.strip():
+                    yield line
+    if buffer.strip():
+        yield buffer
+
+
+def parse_message(line: bytes, username: Optional[str] = None) -> dict:
+    """One exported message; raises ValueError if it is not one (or belongs to another user)"""
+    try:
+        doc = json_util.loads(line, json_options=JSON_OPTIONS)
+    except Exception as e:
+        raise ValueError(f"Invalid JSON: {e}") from e
+    if not isinstance(doc, dict):
+        raise ValueError("Not an object")
+    for field, kind in REQUIRED_FIELDS.items():
+        if not isinstance(doc.get(field), kind):
+            raise ValueError(f"Missing or invalid {field}")
+    if doc["role"] not in ROLES:
+        raise ValueError(f"Unknown role {doc['role']}")
+    if username is not None and doc["username"] != username:
+        raise ValueError(f"Message of another user ({doc['username']})")
+    doc.pop("summarized", None)
+    doc.setdefault("_id", ObjectId())
+    doc.setdefault("source_type", None)
+    doc.setdefault("sources", [])
+    return doc
+
+
+async def import_lines(lines: AsyncIterator[bytes], persist: Callable[[List[dict]], Awaitable[int]],
+                       report: TransferReport, username: Optional[str] = None,
+                       batch_size: int = TRANSFER_BATCH_SIZE) -> TransferReport:
+    """Apply valid messages in batches, in file order; `persist` returns how many of a batch were new"""
+    batch = []
+
+    async def flush():
+        inserted = await persist(batch)
+        report.inserted += inserted
+        report.duplicates += len(batch) - inserted
+        batch.clear()
+
+    async for line in lines:
+        report.docs += 1
+        report.bytes += len(line) + 1
+        try:
+            batch.append(parse_message(line, username))
+        except ValueError:
+            report.rejected += 1
+            continue
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return report.finish()
+
+
+# === CLI ===
+async def read_file(path: str) -> AsyncIterator[bytes]:
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(stream.read, TRANSFER_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+async def export_to_file(database, path: str, username: Optional[str]) -> TransferReport:
+    report = TransferReport()
+    chunks = export_lines(database["chat_history"], export_query(username), report)
+    if path.endswith(".gz"):
+        chunks = gzip_chunks(chunks, report)
+    output = sys.stdout.buffer if path == "-" else open(path, "wb")
+    try:
+        async for chunk in chunks:
+            if not path.endswith(".gz"):
+                report.bytes += len(chunk)
+            await asyncio.to_thread(output.write, chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    return report.finish()
+
+
+async def import_from_file(database, path: str, username: Optional[str]) -> TransferReport:
+    from storage import insert_new
+
+    async def persist(docs: List[dict]) -> int:
+        return len(await insert_new(database["chat_history"], docs))
+
+    return await import_lines(ndjson_lines(read_file(path)), persist, TransferReport(), username)
+
+
+async def refresh_derived(database, summaries: str):
+    """The CLI writes chat_history directly, so rebuild what the API keeps in step on every write"""
+    from pymongo import MongoClient
+
+    from backfill_sessions import backfill
+    from insights import INSIGHTS_ENABLED, Insights
+    from storage import MONGO_DB, MONGO_URI
+
+    if summaries != "skip":
+        client = MongoClient(MONGO_URI)
+        try:
+            total = await asyncio.to_thread(backfill, client[MONGO_DB], summaries == "keep")
+        finally:
+            client.close()
+        print(f"Session summaries refreshed: {total} sessions", file=sys.stderr)
+    if INSIGHTS_ENABLED:
+        # Closed days only; today's imported messages reach the rollups with the next rebuild after midnight
+        await Insights(database["insights_daily"], database["insights_totals"], database["chat_history"],
+                       database["locks"]).rebuild()
+
+
+async def main_async(args):
+    from storage import close_database, connect_database
+
+    database = connect_database()
+    try:
+        if args.command == "export":
+            report = await export_to_file(database, args.out, args.username)
+        else:
+            report = await import_from_file(database, args.path, args.username)
+            if report.inserted:
+                await refresh_derived(database, args.summaries)
+        print(f"{args.command}: {report.as_dict()}", file=sys.stderr)
+    finally:
+        close_database(database)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import chat_history as (gzip) NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Stream messages to a file ('-' for stdout)")
+    export.add_argument("--username", help="Only this user's messages (default: everyone)")
+    export.add_argument("--out", default="chat_history.ndjson.gz")
+    imported = commands.add_parser("import", help="Load messages from a file ('-' for stdin), skipping existing ids")
+    imported.add_argument("path")
+    imported.add_argument("--username", help="Reject messages of any other user")
+    imported.add_argument("--summaries", choices=["keep", "replace", "skip"], default="keep",
+                          help="Rebuild session summaries afterwards, keeping or replacing existing ones")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Deque, Dict, Optional
+
+import httpx
+
+from http_client import HTTP_PER_HOST_LIMIT, AsyncHTTPClient, http
+from telemetry import UPSTREAM_CALLS
+
+# === Upstream Gateway Settings ===
+# Overall time budget of one /chat request; upstream calls get whatever is left of it
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "60"))
+# AIMD concurrency per provider starts here and never exceeds the per-host connection cap
+UPSTREAM_INITIAL_LIMIT = int(os.getenv("UPSTREAM_INITIAL_LIMIT", "16"))
+UPSTREAM_MAX_LIMIT = int(os.getenv("UPSTREAM_MAX_LIMIT", str(HTTP_PER_HOST_LIMIT)))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "4"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+OVERLOAD_STATUS = {429, 503}
+
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def start_request_budget(seconds: float = REQUEST_BUDGET_SECONDS) -> float:
+    deadline = time.monotonic() + seconds
+    request_deadline.set(deadline)
+    return deadline
+
+
+def remaining_budget() -> Optional[float]:
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamError(Exception):
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+class DeadlineExceeded(UpstreamError):
+    pass
+
+
+class AIMDLimiter:
+    """Adaptive concurrency limit: +1 per limit-worth of successes, halved on overload"""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 1000):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @asynccontextmanager
+    async def slot(self, timeout: Optional[float] = None):
+        if self._waiters or self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted a slot just as the wait was abandoned: hand it on
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        else:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        # Every slot the current limit allows goes to a waiter, in arrival order
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / max(self.limit, 1))
+        self._wake()
+
+    def on_overload(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets a single probe through after the cooldown"""
+
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def abandon_probe(self):
+        """The probe ended without an outcome (deadline, cancellation): let the next call probe"""
+        self._probing = False
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class UpstreamGateway:
+    """Adaptive concurrency, retries, deadlines and a circuit breaker for one provider"""
+
+    def __init__(self, name: str, default_timeout: float, initial_limit: int = UPSTREAM_INITIAL_LIMIT,
+                 max_limit: int = UPSTREAM_MAX_LIMIT, client: AsyncHTTPClient = http,
+                 max_retries: int = UPSTREAM_MAX_RETRIES):
+        self.name = name
+        self.client = client
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.limiter = AIMDLimiter(initial_limit, maximum=max_limit)
+        self.breaker = CircuitBreaker()
+        self.retries = 0
+        self.rejected = 0
+
+    def _timeout(self) -> float:
+        remaining = remaining_budget()
+        if remaining is None:
+            return self.default_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(self.name, "request budget exhausted")
+        return min(self.default_timeout, remaining)
+
+    def _check_breaker(self) -> bool:
+        """Raises CircuitOpen, or returns whether this call is the half-open probe"""
+        half_open = self.breaker.state == "half-open"
+        if not self.breaker.allow():
+            self.rejected += 1
+            UPSTREAM_CALLS.inc(provider=self.name, result="circuit_open")
+            raise CircuitOpen(self.name, "circuit open")
+        return half_open
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Queueing for a slot counts against the request budget as well
+        try:
+            async with self.limiter.slot(remaining_budget()) as slot:
+                yield slot
+        except asyncio.TimeoutError:
+            UPSTREAM_CALLS.inc(provider=self.name, result="deadline")
+            raise DeadlineExceeded(self.name, "request budget spent waiting for a slot") from None
+
+    def _record(self, status_code: Optional[int]):
+        UPSTREAM_CALLS.inc(provider=self.name, result="error" if status_code is None else str(status_code))
+        if status_code is None or status_code >= 500 or status_code == 429:
+            self.breaker.on_failure()
+        else:
+            self.breaker.on_success()
+        if status_code in OVERLOAD_STATUS or status_code is None:
+            self.limiter.on_overload()
+        else:
+            self.limiter.on_success()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Non-streaming call with jittered exponential backoff; honours Retry-After"""
+        attempt = 0
+        while True:
+            probe = self._check_breaker()
+            recorded = False
+            try:
+                async with self._slot():
+                    response = await self.client.request(method, url, timeout=self._timeout(), **kwargs)
+            except httpx.TransportError as e:
+                self._record(None)
+                recorded = True
+                response, error = None, e
+            else:
+                self._record(response.status_code)
+                recorded = True
+                if response.status_code not in RETRYABLE_STATUS:
+                    return response
+                error = None
+            finally:
+                if probe and not recorded:
+                    self.breaker.abandon_probe()
+
+            attempt += 1
+            if attempt > self.max_retries:
+                if response is not None:
+                    return response
+                raise UpstreamError(self.name, f"transport error: {error}") from error
+
+            delay = random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+            if response is not None:
+                delay = max(delay, retry_after_seconds(response) or 0)
+            remaining = remaining_budget()
+            if remaining is not None and delay >= remaining:
+                if response is not None:
+                    return response
+                raise DeadlineExceeded(self.name, "no budget left to retry") from error
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """Streaming call: not retried (tokens may already be on the wire), but limited and guarded"""
+        probe = self._check_breaker()
+        recorded = False
+        try:
+            async with self._slot():
+                try:
+                    async with self.client.stream(method, url, timeout=self._timeout(), **kwargs) as response:
+                        self._record(response.status_code)
+                        recorded = True
+                        yield response
+                except httpx.TransportError:
+                    # Errors while the caller reads the body come after the call was recorded as answered
+                    if not recorded:
+                        self._record(None)
+                        recorded = True
+                    raise
+        finally:
+            if probe and not recorded:
+                self.breaker.abandon_probe()
+
+    def stats(self) -> Dict:
+        return {
+            "limit": int(self.limiter.limit),
+            "in_flight": self.limiter.in_flight,
+            "breaker": self.breaker.state,
+            "retries": self.retries,
+            "rejected": self.rejected,
+        }
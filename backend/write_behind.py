@@ -0,0 +1,126 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+# === Write-Behind Settings ===
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+WRITE_BEHIND_FLUSH_MS = int(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_RETRY_MS = int(os.getenv("WRITE_BEHIND_RETRY_MS", "1000"))
+
+
+def merge_pending(docs: List[dict], pending: List[dict]) -> List[dict]:
+    """Overlay unflushed messages on a query result, deduplicated by _id, oldest first"""
+    if not pending:
+        return docs
+    seen = {doc.get("_id") for doc in docs}
+    merged = docs + [doc for doc in pending if doc["_id"] not in seen]
+    merged.sort(key=lambda doc: doc["created_at"])
+    return merged
+
+
+class WriteBehindQueue:
+    """Buffers chat messages from all sessions and persists them in bulk.
+
+    A flush happens when WRITE_BEHIND_MAX_BATCH messages are queued or every
+    WRITE_BEHIND_FLUSH_MS, whichever comes first. Messages stay visible through
+    pending_for() until their batch is written, and drain() flushes everything
+    on shutdown. Each message carries its _id from submit time, so a retried
+    batch cannot insert duplicates.
+    """
+
+    def __init__(self, persist: Callable[[List[dict], bool], Awaitable[None]],
+                 max_batch: int = WRITE_BEHIND_MAX_BATCH, flush_ms: int = WRITE_BEHIND_FLUSH_MS):
+        self.persist = persist
+        self.max_batch = max_batch
+        self.flush_interval = flush_ms / 1000
+        self._queue: List[dict] = []
+        # A failed batch is retried as the same batch, so its idempotency keys stay the same;
+        # persist(batch, retry) is told when it sees a batch again
+        self._retry: List[dict] = []
+        self._by_session: Dict[Tuple[str, str], List[dict]] = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.flushed_batches = 0
+        self.flushed_messages = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, doc: dict):
+        self._queue.append(doc)
+        self._by_session.setdefault((doc["username"], doc["session_id"]), []).append(doc)
+        if len(self._queue) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_for(self, username: str, session_id: str) -> List[dict]:
+        return list(self._by_session.get((username, session_id), ()))
+
+    def pending_sessions(self, username: str) -> Dict[str, dict]:
+        """session_id -> oldest unflushed message, for sessions of this user with queued writes"""
+        return {
+            session_id: docs[0]
+            for (owner, session_id), docs in self._by_session.items()
+            if owner == username and docs
+        }
+
+    def discard(self, username: str, session_id: str):
+        """Drop queued messages of a deleted session so a later flush cannot resurrect it"""
+        docs = self._by_session.pop((username, session_id), [])
+        if docs:
+            dropped = {id(doc) for doc in docs}
+            self._queue = [doc for doc in self._queue if id(doc) not in dropped]
+            self._retry = [doc for doc in self._retry if id(doc) not in dropped]
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(WRITE_BEHIND_RETRY_MS / 1000)
+
+    async def flush(self) -> bool:
+        """Write queued messages in batches; returns False if a batch failed and was requeued"""
+        while self._retry or self._queue:
+            retry = bool(self._retry)
+            if retry:
+                batch, self._retry = self._retry, []
+            else:
+                batch = self._queue[:self.max_batch]
+                self._queue = self._queue[self.max_batch:]
+            try:
+                await self.persist(batch, retry)
+            except Exception as e:
+                print(f"Write-behind flush of {len(batch)} messages failed, will retry: {e}")
+                self._retry = batch
+                return False
+
+            self.flushed_batches += 1
+            self.flushed_messages += len(batch)
+            for doc in batch:
+                key = (doc["username"], doc["session_id"])
+                docs = self._by_session.get(key)
+                if docs is None:
+                    continue
+                docs[:] = [d for d in docs if d is not doc]
+                if not docs:
+                    del self._by_session[key]
+        return True
+
+    async def drain(self, attempts: int = 5):
+        """Stop the background loop and flush everything still queued"""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        for _ in range(attempts):
+            if await self.flush():
+                return
+            await asyncio.sleep(WRITE_BEHIND_RETRY_MS / 1000)
+        print(f"Write-behind drain gave up with {len(self._retry) + len(self._queue)} messages unflushed")
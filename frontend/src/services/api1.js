@@ -1,6 +1,7 @@
 import axios from 'axios';
 
 const API_URL = 'http://localhost:8000';
+const MAX_RECONNECTS = 3;
 
 export const sendMessage = (sessionId, message, username, onChunk) => {
   return new Promise((resolve, reject) => {
@@ -10,14 +11,22 @@ export const sendMessage = (sessionId, message, username, onChunk) => {
 
     let fullResponse = '';
     let sourceType = null;
+    let reconnects = 0;
+    let lastEventId = '';
     let sources = [];
 
     source.onmessage = (event) => {
       try {
+        // Only set when the server streams resumable frames
+        lastEventId = event.lastEventId || lastEventId;
         const data = JSON.parse(event.data);
         console.log("Received chunk:", data);
         
-        if (data.response) {
+        if (data.error) {
+          // Includes a resume that came too late or reached another worker
+          source.close();
+          reject(new Error(`Streaming error: ${data.error}`));
+        } else if (data.response) {
           // Add this chunk to the full response
           fullResponse += data.response;
           
@@ -46,9 +55,6 @@ export const sendMessage = (sessionId, message, username, onChunk) => {
           }
           
           resolve({ response: fullResponse, source_type: sourceType, sources });
-        } else if (data.error) {
-          source.close();
-          reject(new Error(`Streaming error: ${data.error}`));
         }
       } catch (error) {
         console.error("Error parsing SSE chunk:", error);
@@ -58,6 +64,12 @@ export const sendMessage = (sessionId, message, username, onChunk) => {
     };
 
     source.onerror = (error) => {
+      // The browser reconnects with Last-Event-ID and the server resumes the same reply. Without an
+      // event id the reconnect would send the message again and start a second generation
+      if (source.readyState === EventSource.CONNECTING && lastEventId && reconnects < MAX_RECONNECTS) {
+        reconnects += 1;
+        return;
+      }
       console.error("EventSource error:", error);
       source.close();
       reject(new Error('Error streaming message: ' + (error.message || 'Unknown error')));